@@ -1,2 +1,6 @@
-from rephile.main import Rephile
-
+# Rephile is imported on first use so that "import rephile" is cheap.
+def __getattr__(name):
+    if name == "Rephile":
+        from rephile.main import Rephile
+        return Rephile
+    raise AttributeError(f"module 'rephile' has no attribute '{name}'")
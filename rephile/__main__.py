@@ -3,7 +3,7 @@
 Main CLI to rephile
 '''
 import os
-import shutil
+import sys
 import json
 import click
 import functools
@@ -23,12 +23,33 @@ cmddef = dict(context_settings=dict(help_option_names=['-h', '--help']))
               help="The rephile cache")
 @click.option("-j", "--jobs", default=1,
               help="Number of concurrent jobs may be run")
+@click.option("-T", "--thumbs",
+              type=click.Path(dir_okay=True, file_okay=False,
+                              resolve_path=True),
+              envvar='REPHILE_THUMBS',
+              default=None,
+              help="Keep thumbnails as files in this directory, made on first use")
+@click.option("--xattr", is_flag=True, envvar='REPHILE_XATTR',
+              help="Also cache file hashes in their extended attributes")
+@click.option("--profile", is_flag=True,
+              help="Print time spent in each stage and counters on exit")
+@click.option("--profile-json", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write time spent in each stage and counters as JSON")
 @click.pass_context
-def cli(ctx, cache, jobs):
+def cli(ctx, cache, jobs, thumbs, xattr, profile, profile_json):
     '''
     rephile refiles your files
     '''
-    ctx.obj = Rephile(cache, jobs)
+    if profile or profile_json:
+        import rephile.profile as rprofile
+        rprofile.enable()
+        if profile_json:
+            ctx.call_on_close(lambda: rprofile.dump(profile_json))
+        if profile:
+            ctx.call_on_close(lambda: click.echo(rprofile.text(), err=True))
+    ctx.obj = Rephile(cache, jobs, thumbs, xattr)
+    ctx.call_on_close(ctx.obj.close)
 
 
 @cli.command("exif")
@@ -57,16 +78,57 @@ def init(ctx):
     ctx.obj.init()
 
 
+def walk_options(func):
+    'Options shared by commands descending directories'
+    opts = [
+        click.option("-i", "--include", multiple=True,
+                     help="Only take files found under directories "
+                     "with names matching this glob"),
+        click.option("-x", "--exclude", multiple=True,
+                     help="Skip files and directories matching this glob")]
+    for opt in reversed(opts):
+        func = opt(func)
+    return func
+
+
 @cli.command("digest")
 @click.option("-F", "--force", is_flag=True,
               help="Force an update to the cache")
+@walk_options
+@click.option("-b", "--batch", default=1000,
+              help="Number of files to commit to the cache at a time")
+@click.option("-p", "--progress", is_flag=True,
+              help="Report progress on stderr")
 @click.argument("files", nargs=-1)
 @click.pass_context
-def digest(ctx, force, files):
-    'Import information about files'
-    digs = ctx.obj.digest(files, force)
-    for dig in digs:
-        click.echo(dig.id)
+def digest(ctx, force, include, exclude, batch, progress, files):
+    '''Import information about files
+
+    Directories are descended.  A file of "-" reads file names from
+    stdin, one per line.
+    '''
+    done = 0
+    for got in ctx.obj.ingest(stdin_files(files), include, exclude,
+                              batch, force):
+        for path, dig in got:
+            click.echo(dig.id)
+        done += len(got)
+        if progress:
+            click.echo(f"digested {done} files", err=True)
+
+
+def stdin_files(files):
+    '''
+    Generate files, replacing "-" with names read from stdin.
+    '''
+    for one in files:
+        if one != "-":
+            yield one
+            continue
+        for line in sys.stdin:
+            line = line.rstrip("\n")
+            if line:
+                yield line
 
 
 def select_digests(func):
@@ -91,7 +153,7 @@ def select_digests(func):
 def lines(ctx, force, format, delimiter, files):
     'Format information about each file into one line of text.'
     from rephile.paths import asdict
-    paths = ctx.obj.paths(files)
+    paths = ctx.obj.paths(files, force)
 
     lines = [format.format(**asdict(p)) for p in paths]
     # delightfully dangerous
@@ -102,47 +164,30 @@ def lines(ctx, force, format, delimiter, files):
 
 
 @cli.command("tag")
+@click.option("-F", "--force", is_flag=True,
+              help="Force an update to the cache")
 @click.option("-t", "--tag", multiple=True,
-              help="A tag to add to the UserTags attribute of the files")
+              help="A tag to add to (or remove from) the files")
+@click.option("-u", "--untag", is_flag=True,
+              help="Remove the tags given with -t/--tag instead of adding")
 @click.argument("files", nargs=-1)
 @click.pass_context
-def tag(ctx, tag, files):
+def tag(ctx, force, tag, untag, files):
     '''
-    Add or get user tags.
+    Add, remove or list tags of files.
 
-    If no tags are given with -t/--tag then tags will be retrieved.
+    If no tags are given with -t/--tag then the tags of each file are
+    listed.  A file of "-" reads file names from stdin, one per line.
     '''
-    print("replace with call to rephile.tag functions")
-    return
-
-    # fixme: move this into tag.py and add interface to main.py
-    from .dbtypes import Attribute, AttrType
-    tag = list(tag)
-    digs = ctx.obj.digest(files)
-    fresh = list()
-    for dig in digs:
-        ut = dig.find_attr('UserTags')
-
-        if tag:                 # setting
-
-            if ut is None:      # new
-                attr = Attribute(name='UserTags', text=' '.join(tag),
-                                 atype=AttrType.string, digest_id=dig.id)
-                fresh.append(attr)
-
-            else:               # existing
-                new = list(set(ut.text.split() + tag))
-                new.sort()
-                new = ' '.join(new)
-                ut.text = new
-                fresh.append(ut)
-            continue
-        # getting
-        print(dig.paths[0].id, ut.text)
-    if fresh:
-        ctx.obj.session.add_all(fresh)
-        ctx.obj.session.commit()
-    return
+    files = list(stdin_files(files))
+    if not tag:
+        for path, names in zip(files, ctx.obj.tagnames(files, force)):
+            click.echo(f'{path} {" ".join(names)}')
+        return
+    if untag:
+        ctx.obj.untag(files, *tag, force=force)
+    else:
+        ctx.obj.tag(files, *tag, force=force)
 
 
 @cli.command("render")
@@ -161,7 +206,7 @@ def render(ctx, force, template, files):
     '''
 
     from rephile.templates import render as doit
-    paths = ctx.obj.paths(files, force)
+    paths = ctx.obj.paths(files, force, thumbs=True)
     digs = dict()
     for path in paths:
         dig = path.digest
@@ -182,49 +227,82 @@ def render(ctx, force, template, files):
 @click.option("-m", "--method", default="copy",
               type=click.Choice(["copy", "move", "hard", "soft",]),
               help="Method for making a file from input files")
+@click.option("-t", "--threads", default=8,
+              help="Number of concurrent file operations")
 @click.argument("files", nargs=-1)
 @click.pass_context
-def make(ctx, dry_run, force, format, method, files):
-    'Make new files from old'
-    from rephile.paths import asdict
+def make(ctx, dry_run, force, format, method, threads, files):
+    '''Make new files from old
 
-    paths = ctx.obj.paths(files)
-    tgts = [format.format_map(**asdict(p)) for p in paths]
-
-    for src, tgt in zip(files, tgts):
-        if os.path.abspath(src) == os.path.abspath(tgt):
-            print(f"same: {src} <--> {tgt}")
-            return
+    Files of identical content are made once and hard linked to.
+    Existing targets are left as they are.
+    '''
+    try:
+        steps = ctx.obj.make(files, format, method, threads, dry_run, force)
+    except ValueError as err:
+        raise click.ClickException(str(err))
+    for step in steps:
+        if step.method in ("same", "exists"):
+            print(f"{step.method}: {step.src} <--> {step.tgt}")
+        elif step.dup:
+            print(f"{step.method}: {step.src} ---> {step.tgt} (link {step.dup})")
+        else:
+            print(f"{step.method}: {step.src} ---> {step.tgt}")
+
+
+@cli.command("dupes")
+@walk_options
+@click.argument("files", nargs=-1)
+@click.pass_context
+def dupes(ctx, include, exclude, files):
+    '''Print groups of files with identical content.
 
-        print(f"{method}: {src} ---> {tgt}")
-        if dry_run:
-            continue
+    Directories are descended.  Groups are separated by a blank line.
+    '''
+    for ind, (sha, size, paths) in enumerate(
+            ctx.obj.dupes(stdin_files(files), include, exclude)):
+        if ind:
+            click.echo()
+        for path in paths:
+            click.echo(f"{size:10} {sha} {path}")
 
-        tgt_dir = os.path.dirname(tgt)
-        if not os.path.exists(tgt_dir):
-            os.makedirs(tgt_dir)
 
-        if os.path.exists(tgt):
-            os.remove(src)
+@cli.command("similar")
+@click.option("-F", "--force", is_flag=True,
+              help="Force an update to the cache")
+@click.option("-k", "--distance", default=8,
+              help="Largest Hamming distance (of 64 bits) to call similar")
+@click.option("--fill", is_flag=True,
+              help="First hash cached images lacking a perceptual hash")
+@click.argument("files", nargs=-1)
+@click.pass_context
+def similar(ctx, force, distance, fill, files):
+    '''Print cached images that look like the files.
 
-        if method == "copy":
-            shutil.copy(src, tgt, follow_symlinks=False)
-            continue
+    Each file is followed by lines of distance and path of similar
+    images, the nearest first.  Images cached before perceptual hashes
+    were kept are found only after a run with --fill.
+    '''
+    nears = ctx.obj.similar(files, distance, force, fill)
+    for path, near in zip(files, nears):
+        click.echo(path)
+        for dist, dig in near:
+            for one in dig.paths:
+                click.echo(f"{dist:4} {one.id}")
 
-        if method == "move":
-            shutil.move(src, tgt)
-            continue
 
-        if method == "soft":
-            if os.path.islink(src):
-                os.symlink(os.path.realpath(src), tgt)
-            else:
-                os.symlink(src, tgt)
-            continue
+@cli.command("find")
+@click.argument("predicates", nargs=-1)
+@click.pass_context
+def find(ctx, predicates):
+    '''Print paths of cached files with matching attributes.
 
-        if method == "hard":
-            os.link(src, tgt)
-            continue
+    Each predicate is like "ISO>3200", "Model=Canon EOS R5",
+    "DateTimeOriginal>=2019-01-01" or "Model~%Canon%".
+    '''
+    for dig in ctx.obj.find(*predicates):
+        for path in dig.paths:
+            click.echo(path.id)
 
 
 @cli.command("asdata")
@@ -234,53 +312,61 @@ def asdata(ctx, files):
     'File info as avilable to format'
     from rephile.paths import asdict
     paths = ctx.obj.paths(files)
-    text = json.dumps([asdict(p) for p in paths], indent=4)
+    text = json.dumps([asdict(p) for p in paths], indent=4, default=str)
     print(text)
 
 
-@cli.command("imgur")
-@click.option("-w", "--web", is_flag=True,
-              help="Open resulting imgur links in web browser")
-@click.argument("files", nargs=-1)
-@click.pass_context
-def imgur(ctx, web, files):
-    '''Upload files to imgur.
-
-    See docs for info about imgur api key.  We try to reuse setup for
-    imgur-uploader.  https://pypi.org/project/imgur-uploader/
-    '''
-    from rephile.imgur import upload
+def upload_options(func):
+    'Options shared by commands uploading files'
+    opts = [
+        click.option("-w", "--web", is_flag=True,
+                     help="Open resulting links in web browser"),
+        click.option("-t", "--threads", default=4,
+                     help="Number of concurrent uploads"),
+        click.option("-a", "--again", is_flag=True,
+                     help="Upload even if content was uploaded before"),
+        click.option("-F", "--force", is_flag=True,
+                     help="Force file digest calculation"),
+        click.argument("files", nargs=-1),
+        click.pass_context]
+    for opt in reversed(opts):
+        func = opt(func)
+    return func
+
+
+def upload(ctx, service, files, web, threads, again, force):
+    'Upload files to service, return number which failed'
     import webbrowser
 
-    paths = ctx.obj.paths(files)
-    for path in paths:
-        url = upload(path.id)
+    failed = 0
+    for path, url in ctx.obj.upload(files, service, threads, again, force):
         if not url:
-            ctx.exit(-1)
+            click.echo(f"failed to upload {path.id}", err=True)
+            failed += 1
+            continue
         click.echo(url)
         if web:
             webbrowser.open(url)
+    return failed
+
+
+@cli.command("imgur")
+@upload_options
+def imgur(ctx, **kwds):
+    '''Upload files to imgur.
+
+    See docs for info about imgur api key.  We try to reuse setup for
+    imgur-uploader.  https://pypi.org/project/imgur-uploader/
+    '''
+    if upload(ctx, "imgur", **kwds):
+        ctx.exit(-1)
 
 
 @cli.command("0x0")
-@click.option("-w", "--web", is_flag=True,
-              help="Open resulting imgur links in web browser")
-@click.argument("files", nargs=-1)
-@click.pass_context
-def ohecksoh(ctx, web, files):
+@upload_options
+def ohecksoh(ctx, **kwds):
     'Upload files to 0x0.st.'
-    from rephile.ohecksoh import upload
-    import webbrowser
-
-    paths = ctx.obj.paths(files)
-    for path in paths:
-        url = upload(path.id)
-        if not url:
-            click.echo(f"failed to upload {path.id}")
-            continue
-        click.echo(url)
-        if web:
-            webbrowser.open(url)
+    upload(ctx, "0x0", **kwds)
 
 
 def main():
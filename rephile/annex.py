@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''
+Low level recognition of files kept in git-annex.
+
+An annexed file is a symlink into .git/annex/objects/ or, if unlocked
+and its content is not present, a small pointer file holding
+"/annex/objects/<key>".  A key such as SHA256E-s1234--<sha256>.jpg
+gives the size and SHA-256 of the content without reading it.
+'''
+import os
+import re
+import subprocess
+from functools import lru_cache
+
+# Only SHA256 keys give a hash rephile can use.
+keyre = re.compile(r'SHA256E?-s(\d+)(?:-[mSC]\d+)*--([0-9a-f]{64})(?:\.\S*)?$')
+
+# The largest file git-annex takes as a pointer file.
+pointermax = 32768
+
+prefix = b"/annex/objects/"
+
+
+def parse(key):
+    'Return (sha, size) from a SHA256 git-annex key, else None'
+    m = keyre.match(key)
+    if m:
+        return (m.group(2), int(m.group(1)))
+
+
+def link(fname):
+    '''
+    Return (sha, size) if fname is an annex symlink with a SHA256 key.
+
+    The content is not read and need not be present.
+    '''
+    if not os.path.islink(fname):
+        return None
+    tgt = os.readlink(fname)
+    if "annex/objects/" not in tgt:
+        return None
+    return parse(os.path.basename(tgt))
+
+
+def pointer(data):
+    '''
+    Return (sha, size) if data is all of an annex pointer file.
+
+    That is one line holding the key, with nothing after it.
+    '''
+    if len(data) > pointermax or data[:len(prefix)] != prefix:
+        return None
+    line = bytes(data).rstrip(b"\n")
+    if b"\n" in line:
+        return None
+    return parse(os.path.basename(line.decode("utf-8", "replace")))
+
+
+@lru_cache(maxsize=None)
+def toplevel(dname):
+    'Return top directory of the git-annex holding directory dname or None'
+    if os.path.isdir(os.path.join(dname, ".git", "annex")):
+        return dname
+    up = os.path.dirname(dname)
+    if up == dname:
+        return None
+    return toplevel(up)
+
+
+@lru_cache(maxsize=None)
+def uuid(top):
+    'Return the annex.uuid of the git-annex at top or None'
+    try:
+        got = subprocess.run(["git", "-C", top, "config", "annex.uuid"],
+                             capture_output=True, text=True)
+    except OSError:
+        return None
+    return got.stdout.strip() or None
@@ -2,10 +2,29 @@
 '''
 Medium level operations on Attribute
 '''
-from rephile.dbtypes import Attribute, AttrType
+import re
+import operator
+from datetime import date
+from sqlalchemy import select, update, or_, func, false
+from rephile.dbtypes import Attribute, AttrType, Digest, exiftime
 from rephile.jobs import pmapgroup
 from rephile.files import exif
 
+def typed(val):
+    '''
+    Return dict of Attribute column values for a value.
+    '''
+    if type(val) == int:
+        return dict(atype=AttrType.integer, text=str(val),
+                    integer=val, real=float(val))
+    if type(val) == float:
+        return dict(atype=AttrType.rational, text=str(val), real=val)
+    text = str(val)
+    when = exiftime(text) if isinstance(val, str) else None
+    if when is not None:
+        return dict(atype=AttrType.datetime, text=text, time=when)
+    return dict(atype=AttrType.string, text=text)
+
 def make_some(pis):
     '''
     Make some attributes from a zip of (path,digest ID)
@@ -16,14 +35,7 @@ def make_some(pis):
     for pi, md in zip(pis, mds):
         path, did = pi
         for key,val in md.items():
-            if type(val) == int:
-                atype = AttrType.integer
-            elif type(val) == float:
-                atype = AttrType.rational
-            else:
-                atype = AttrType.string
-            attr = Attribute(name=key, text=str(val), atype=atype,
-                             digest_id = did)
+            attr = Attribute(name=key, digest_id = did, **typed(val))
             ret.append(attr)
     return ret
 
@@ -32,4 +44,124 @@ def make(pis, nproc=1):
     return pmapgroup(make_some, pis, nproc)
 
 
-    
+def backfill(session, batch=1000):
+    '''
+    Set the typed value columns of Attributes from their text.
+
+    This is for caches made before the columns existed.
+    '''
+    q = select(Attribute.id, Attribute.atype, Attribute.text)
+    rows = list()
+    for aid, atype, text in session.execute(q):
+        try:
+            val = atype.cast(text) if atype else text
+        except (TypeError, ValueError):
+            continue
+        row = typed(val)
+        if row["atype"] == AttrType.string:
+            continue
+        rows.append(dict(id=aid, atype=row["atype"],
+                         integer=row.get("integer"), real=row.get("real"),
+                         time=row.get("time")))
+    for ind in range(0, len(rows), batch):
+        session.execute(update(Attribute), rows[ind:ind + batch])
+    session.commit()
+
+
+ops = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "~": lambda col, val: col.like(val),
+}
+
+# Operators which compare for (in)equality
+equality = ("=", "==", "!=")
+
+def cast(text):
+    '''
+    Return text as a number or date-time if it looks like one, else as is.
+    '''
+    for meth in (int, float):
+        try:
+            return meth(text)
+        except ValueError:
+            pass
+    when = exiftime(text)
+    return text if when is None else when
+
+def parse(text):
+    '''
+    Parse predicate text like "ISO>3200" into (name, op, value).
+
+    The value of an ordering operator is cast() to a number or
+    date-time if it looks like one.  Other values are kept as text.
+    The "~" operator matches a SQL LIKE pattern.
+    '''
+    m = re.match(r'\s*(\w[\w:-]*)\s*(==|!=|<=|>=|=|<|>|~)\s*(.*)$', text)
+    if not m:
+        raise ValueError(f"can not parse attribute predicate: {text}")
+    name, op, val = m.groups()
+    if op not in equality and op != "~":
+        val = cast(val)
+    return (name, op, val)
+
+def typed_column(value):
+    '''
+    Return (column, value) to compare a number or date-time value in SQL.
+
+    Numbers compare to the real column, datetimes to the time column
+    and anything else to the text.
+    '''
+    if isinstance(value, (int, float)):
+        return (Attribute.real, value)
+    if isinstance(value, date):
+        return (Attribute.time, value)
+    return (Attribute.text, str(value))
+
+def predicate(name, op, value):
+    '''
+    Return SQL clause selecting Digests with attribute name matching.
+
+    Ordering operators compare in the column typed_column() gives.
+    Equality is of the text or, if the value looks like a number or
+    date-time, of the typed value.
+    '''
+    if op not in ops:
+        raise ValueError(f"unknown attribute operator: {op}")
+    if op in equality:
+        text = value if isinstance(value, str) else str(value)
+        if isinstance(value, str):
+            value = cast(value)
+        match = [Attribute.text == text]
+        col, val = typed_column(value)
+        if col is not Attribute.text:
+            match.append(col == val)
+        cond = or_(*match)
+        if op == "!=":
+            # NULL typed columns make NULL, not false
+            cond = ~func.coalesce(cond, false())
+    elif op == "~":
+        cond = Attribute.text.like(str(value))
+    else:
+        col, val = typed_column(value)
+        cond = ops[op](col, val)
+    sub = select(Attribute.digest_id).where(Attribute.name == name, cond)
+    return Digest.id.in_(sub)
+
+def query(session, *preds):
+    '''
+    Return query of Digests with attributes matching all predicates.
+
+    Each predicate is a (name, op, value) tuple or text to parse().
+    '''
+    q = session.query(Digest)
+    for pred in preds:
+        if isinstance(pred, str):
+            pred = parse(pred)
+        q = q.filter(predicate(*pred))
+    return q
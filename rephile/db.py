@@ -2,9 +2,80 @@
 '''Functions that operate on the cache db.'''
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, event, text
 from sqlalchemy.orm import sessionmaker
+# fixme: this is for upsert.  One day, maybe something besides sqlite is used.
+from sqlalchemy.dialects.sqlite import insert as upsert
 from rephile.dbtypes import Base
+from rephile import profile
+
+# Keys per IN() clause.  SQLite before 3.32 allows at most 999 bound
+# parameters per statement and long IN() lists are slow to plan.
+maxvars = 500
+
+def inchunks(query, column, keys, size=None):
+    '''
+    Generate results of query for rows with column value in keys.
+
+    Any number of keys may be given.  Duplicates are dropped and the
+    rest sent size at a time in an IN() clause.
+    '''
+    size = size or maxvars
+    keys = list(dict.fromkeys(keys))
+    for ind in range(0, len(keys), size):
+        yield from query.filter(column.in_(keys[ind:ind + size]))
+
+_column_keys = dict()
+
+def asrow(obj):
+    '''
+    Return dict of the column values set on a mapped object.
+
+    A dict is returned as-is.
+    '''
+    if isinstance(obj, dict):
+        return obj
+    cls = type(obj)
+    keys = _column_keys.get(cls, None)
+    if keys is None:
+        keys = [attr.key for attr in inspect(cls).column_attrs]
+        _column_keys[cls] = keys
+    have = obj.__dict__
+    return {k: have[k] for k in keys if k in have}
+
+def insert(session, entity, rows, update=None, index=None, batch=1000):
+    '''
+    Insert rows into the table of a mapped class in bulk.
+
+    Rows are dicts of column values or (unsaved) mapped objects.  They
+    are written batch at a time with executemany, bypassing the ORM
+    unit of work.  Rows conflicting on index (default primary key)
+    are skipped, or if update is a list of column names (or True for
+    all given columns) those columns are updated.
+    '''
+    rows = [asrow(r) for r in rows]
+    if not rows:
+        return
+    keys = dict()
+    for row in rows:
+        keys.update(dict.fromkeys(row))
+    rows = [{k: row.get(k, None) for k in keys} for row in rows]
+
+    table = entity.__table__
+    stmt = upsert(table)
+    if update:
+        if index is None:
+            index = [c.name for c in table.primary_key]
+        if update is True:
+            update = [k for k in keys if k not in index]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index,
+            set_={k: stmt.excluded[k] for k in update})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index)
+    with profile.stage("db.insert"):
+        for ind in range(0, len(rows), batch):
+            session.execute(stmt, rows[ind:ind + batch])
 
 def engine(url):
     'Get db engine'
@@ -12,7 +83,16 @@ def engine(url):
         raise ValueError("no db url given, set REPHILE_CACHE?")
     if ":" not in url:          # a file
         url = "sqlite:///"+url
-    return create_engine(url, echo=False)
+    e = create_engine(url, echo=False)
+    if profile.enabled:
+        event.listen(e, "after_cursor_execute", _profile_statement)
+    return e
+
+def _profile_statement(conn, cursor, statement, params, context, executemany):
+    profile.count("db statements")
+    if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE") \
+       and cursor.rowcount > 0:
+        profile.count("db rows written", cursor.rowcount)
 
 def init(url):
     '''
@@ -22,18 +102,74 @@ def init(url):
     Base.metadata.create_all(e)
     return e
 
+def upgrade(e):
+    '''
+    Bring the schema of an existing cache up to date.
+
+    Missing tables and indexes are created and missing columns added
+    (as NULL in existing rows).  Return list of names of the tables
+    and "table.column" columns which were added.
+    '''
+    insp = inspect(e)
+    have = set(insp.get_table_names())
+    if not have:
+        return []               # not initialized
+    tables = Base.metadata.sorted_tables
+    added = [t.name for t in tables if t.name not in have]
+    Base.metadata.create_all(e, tables=[t for t in tables
+                                        if t.name not in have])
+    with e.begin() as conn:
+        for table in tables:
+            if table.name not in have:
+                continue
+            cols = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in cols:
+                    continue
+                if not col.nullable:
+                    raise ValueError(f"rephile cache lacks {table.name}."
+                                     f"{col.name}, re-init your cache")
+                ctype = col.type.compile(e.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" '
+                                  f'ADD COLUMN "{col.name}" {ctype}'))
+                added.append(f"{table.name}.{col.name}")
+            idxs = {i["name"] for i in insp.get_indexes(table.name)}
+            for idx in table.indexes:
+                if idx.name not in idxs:
+                    idx.create(conn)
+    return added
+
 def session(dbfile):
     '''
     Return a DB session
+
+    The schema of an existing cache is upgraded, see upgrade() and
+    migrate().
     '''
     if not dbfile:
         raise ValueError("no rephile cache, set REPHILE_CACHE?")
+    added = []
     if os.path.exists(dbfile):
         e = engine(dbfile)
+        added = upgrade(e)
     else:
         e = init(dbfile)
     if not dbfile == "sqlite://" and os.stat(dbfile).st_size == 0:
         raise ValueError("rephile cache is not initialized")
     Session = sessionmaker(bind=e)
-    return Session()
+    ses = Session()
+    if added:
+        migrate(ses, added)
+    return ses
+
+def migrate(session, added):
+    '''
+    Fill in data held in tables and columns newly added by upgrade().
+    '''
+    if "attribute.real" in added:
+        import rephile.attrs
+        rephile.attrs.backfill(session)
+    if "tagclosure" in added:
+        import rephile.tags
+        rephile.tags.reclose(session)
 
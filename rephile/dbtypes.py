@@ -3,11 +3,13 @@
 rephile cache types
 '''
 import os
+import re
 import enum
+from datetime import datetime
 
 from sqlalchemy import Column, Integer, String, Enum, ForeignKey, \
-    LargeBinary, DateTime, UniqueConstraint
-from sqlalchemy.orm import relationship, declarative_base
+    LargeBinary, DateTime, Float, UniqueConstraint, Index
+from sqlalchemy.orm import relationship, declarative_base, object_session
 
 Base = declarative_base()
 
@@ -30,6 +32,9 @@ class Digest(Base):
     mime = Column(String)
     magic = Column(String)
 
+    # Perceptual hash of an image as signed 64 bit, see rephile.phash
+    phash = Column(Integer)
+
     attrs = relationship("Attribute", backref="digest")
     paths = relationship("Path", backref="digest")
     thumbs = relationship("Thumb", backref="digest")
@@ -67,9 +72,26 @@ class Digest(Base):
         return self._attrdict
 
     def thumb(self, fdsize="normal"):
+        '''Return Thumb of freedesktop size label fdsize or None.
+
+        If the session has a thumbnail store (info["thumbs"]) and the
+        cache holds no such Thumb, it is taken from the store, which
+        generates it on first request.
+        '''
         for one in self.thumbs:
             if fdsize == one.fdsize:
                 return one
+        session = object_session(self)
+        store = session.info.get("thumbs") if session else None
+        if store is None:
+            return None
+        lazy = getattr(self, '_lazythumbs', None)
+        if lazy is None:
+            lazy = self._lazythumbs = dict()
+        if fdsize not in lazy:
+            import rephile.thumbs
+            lazy[fdsize] = rephile.thumbs.lazy(self, fdsize, store)
+        return lazy[fdsize]
 
 class Tag(Base):
     '''
@@ -93,9 +115,38 @@ class Tag(Base):
     def digests(self):
         return [x.tail for x in self.digest_edges]
 
-# Putting a graph in SQL may not be performant.
-# An alernative is storing all ancestor node IDs in an array.
-# https://www.sqlite.org/json1.html
+    def ancestors(self):
+        'All tags this tag is under, transitively'
+        return object_session(self).query(Tag).join(
+            TagClosure, TagClosure.ancestor_id == Tag.id).filter(
+                TagClosure.descendant_id == self.id,
+                TagClosure.ancestor_id != self.id).all()
+
+    def descendants(self):
+        'All tags under this tag, transitively'
+        return object_session(self).query(Tag).join(
+            TagClosure, TagClosure.descendant_id == Tag.id).filter(
+                TagClosure.ancestor_id == self.id,
+                TagClosure.descendant_id != self.id).all()
+
+# Putting a graph in SQL may not be performant.  Walking it one edge
+# at a time certainly is not, so TagClosure holds every (ancestor,
+# descendant) pair and is kept up to date as edges are added.
+
+class TagClosure(Base):
+    '''
+    Transitive closure of the tag graph.
+
+    There is one row for each tag and each tag it is under, directly
+    or not, including itself.  See rephile.tags.
+    '''
+    __tablename__ = "tagclosure"
+
+    ancestor_id = Column(Integer, ForeignKey("tag.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("tag.id"), primary_key=True)
+
+    __table_args__ = (Index('ix_tagclosure_descendant',
+                            'descendant_id', 'ancestor_id'),)
 
 class TagTagEdge(Base):
     '''
@@ -148,36 +199,66 @@ class DigestTagEdge(Base):
         Digest, primaryjoin=digest_id == Digest.id, backref="tag_edgess"
     )
 
-    __table_args__ = (UniqueConstraint('digest_id', 'tag_id'),)
+    __table_args__ = (UniqueConstraint('digest_id', 'tag_id'),
+                      Index('ix_digesttagedge_tag', 'tag_id', 'digest_id'))
 
     def __init__(self, digest, tag):
         self.digest = digest
         self.tag = tag
 
 
+def exiftime(text):
+    '''
+    Return datetime from EXIF style "YYYY:MM:DD HH:MM:SS" text or None.
+
+    Sub-seconds and time zone are ignored.  Dashes may be used in the
+    date and the time may be omitted.
+    '''
+    m = re.match(r'(\d{4})[:-](\d\d)[:-](\d\d)(?:[ T](\d\d):(\d\d)(?::(\d\d))?)?',
+                 text)
+    if not m:
+        return None
+    try:
+        return datetime(*[int(x or 0) for x in m.groups()])
+    except ValueError:          # eg "0000:00:00 00:00:00"
+        return None
+
 class AttrType(enum.Enum):
     string = 0
     integer = 1
     rational = 2
+    datetime = 3
 
     def cast(self, value):
-        meth = [str,int,float][self.value]
+        # A date-time keeps its text, with any sub-seconds and time
+        # zone.  Attribute.time is only for comparing in SQL.
+        meth = [str,int,float,str][self.value]
         return meth(value)
     
 class Attribute(Base):
     '''
     Metadata associated to some data through a digest.
+
+    The value is always held as text.  Numbers are also held in real
+    (and integers in integer) and date-times in time so that they may
+    be compared in SQL.
     '''
     __tablename__ = "attribute"
     id = Column(Integer, primary_key=True)
     name = Column(String)
     text = Column(String)
     atype = Column(Enum(AttrType))
+    integer = Column(Integer)
+    real = Column(Float)
+    time = Column(DateTime)
     digest_id = Column(Integer, ForeignKey('digest.id'),
                        nullable=False)
 
     __table_args__ = (UniqueConstraint('digest_id', 'name',
-                                       name='_name_uc'),)
+                                       name='_name_uc'),
+                      Index('ix_attribute_name_text', 'name', 'text'),
+                      Index('ix_attribute_name_real', 'name', 'real'),
+                      Index('ix_attribute_name_time', 'name', 'time'),)
 
     @property
     def value(self):
@@ -215,9 +296,16 @@ class Path(Base):
     atime = Column(DateTime, default=0)
     mtime = Column(DateTime, default=0)
     ctime = Column(DateTime, default=0)
+    size = Column(Integer)
+    inode = Column(Integer)
     digest_id = Column(Integer, ForeignKey("digest.id"))
     collection_id = Column(Integer, ForeignKey("collection.id"))
 
+    @property
+    def signature(self):
+        'Stat signature recorded when the path was last digested'
+        return (self.size, self.inode, self.mtime)
+
     @property
     def base(self):
         return os.path.basename(self.id)
@@ -230,6 +318,18 @@ class Path(Base):
     def ext(self):
         return os.path.splitext(self.id)[1][1:]
 
+class Upload(Base):
+    '''
+    Where the content of one digest was uploaded to a service
+    '''
+    __tablename__ = "upload"
+    digest_id = Column(String, ForeignKey("digest.id"), primary_key=True)
+    service = Column(String, primary_key=True)   # eg "imgur" or "0x0"
+    url = Column(String)
+    time = Column(DateTime, default=datetime.now)
+
+    digest = relationship("Digest", backref="uploads")
+
 class Thumb(Base):
     '''
     Thumbnail image information associated with one digest
@@ -241,6 +341,9 @@ class Thumb(Base):
     height = Column(Integer)
     image = Column(LargeBinary) # PNG binary
 
+    # Image file name if the thumb is held in a store, not in the cache
+    file = None
+
     @property
     def fdsize(self):
         'Freedesktop size label'
@@ -255,10 +358,31 @@ class Thumb(Base):
         if self.width <= 1024 and self.height <= 1024:
             return "xx-large"
         return "xxx-large"      # not a freedesktop standard
-        
+
+    @property
+    def mime(self):
+        if self.file is None:
+            return "image/png"
+        ext = os.path.splitext(self.file)[1][1:]
+        return "image/" + dict(jpg="jpeg").get(ext, ext)
+
+    def data(self):
+        'Return image file content'
+        if self.file is None:
+            return self.image
+        with open(self.file, 'rb') as fp:
+            return fp.read()
+
     def encode(self):           # future: add arg to set encoding
         import base64
-        return base64.b64encode(self.image)
+        return base64.b64encode(self.data())
 
     def htmldata(self):
-        return "data:image/png;base64," + self.encode().decode()
+        return "data:" + self.mime + ";base64," + self.encode().decode()
+
+    def href(self):
+        'Return URL to the image, a file if in a store else a data URI'
+        if self.file is None:
+            return self.htmldata()
+        from urllib.parse import quote
+        return "file://" + quote(self.file)
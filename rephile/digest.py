@@ -3,23 +3,29 @@
 Medium level operations on Digest.
 '''
 import os
+from functools import partial
 from rephile.dbtypes import *
 from rephile.jobs import pmapgroup
+from rephile.db import inchunks, insert
 import rephile.files as rfiles
+from rephile import profile
 
 
-def make_one(path, sha=None):
-    'Return Digest given a current path'
+def make_one(path, sha=None, size=None):
+    '''Return Digest given a current path
+
+    The content type is left unset if the content is absent, as for a
+    git-annex file not present.
+    '''
     if sha is None:
-        sha, size = rfiles.hashsize_one(path)
-    else:
+        sha, size, mime, desc = rfiles.sniff_one(path)
+        return Digest(id=sha, size=size, mime=mime, magic=desc)
+    if size is None:
         size = os.stat(path).st_size
-    dig = Digest(
-        id = sha,
-        size = size,
-        mime = rfiles.mime_one(path),
-        magic = rfiles.magic_one(path))
-        
+    dig = Digest(id = sha, size = size)
+    if os.path.exists(path):
+        dig.mime = rfiles.mime_one(path)
+        dig.magic = rfiles.magic_one(path)
     return dig
 
 
@@ -67,61 +73,120 @@ def make(paths, nproc=1):
 import rephile.paths as rpaths
 import rephile.attrs as rattrs
 import rephile.thumbs as rthumbs
+import rephile.phash as rphash
 
-def fresh(session, paths, nproc=1):
+def fresh(session, paths, nproc=1, force=False, xattr=False):
     '''
     Return array of Digests corresponding to paths
+
+    Paths already in the cache with an unchanged stat signature are
+    not rehashed unless force is True.  If xattr is True, hashes are
+    also read from and written to extended attributes of the files
+    (see rephile.files.xattr_get()), only written if force is True.
     '''
-    path_hss = pmapgroup(rfiles.hashsize, paths, nproc)
     ptoh = dict()
+    if not force:
+        with profile.stage("digest.known"):
+            ptoh = rpaths.known(session, paths)
+    tohash = [p for p in paths if p not in ptoh]
+    profile.count("paths cached", len(ptoh))
+    profile.count("paths hashed", len(tohash))
+    sniffed = dict()
+    if tohash:
+        # Hash, size and content type from one read of each file.
+        with profile.stage("digest.hash"):
+            if xattr and force:
+                xattr = "write"
+            path_hss = pmapgroup(partial(rfiles.sniff, xattr=xattr),
+                                 tohash, nproc,
+                                 rfiles.sizes(tohash))
+        for path, hs in zip(tohash, path_hss):
+            ptoh[path] = hs[0]
+            sniffed[path] = hs
+    # A Digest is made from a path with its content present, if any.
+    absent = lambda p: p in sniffed and sniffed[p][2] is None
     htop = dict()
-    htos = dict()
-    for path, hs in zip(paths, path_hss):
-        sha = hs[0]
-        ptoh[path] = sha
-        htop[sha] = path
-        htos[sha] = hs[1]
-
-    have_digs = session.query(Digest).filter(Digest.id.in_(htop)).all()
-    htod = {d.id:d for d in have_digs}
-    fresh_objs = list()
-    for sha, path in htop.items():
-        if sha in htod:
-            continue
-
-        # New Digest
-        dig = make_one(path, sha)
+    for path in paths:
+        sha = ptoh[path]
+        if sha not in htop or absent(htop[sha]):
+            htop[sha] = path
+
+    with profile.stage("digest.lookup"):
+        have_digs = inchunks(session.query(Digest), Digest.id, htop)
+        htod = {d.id:d for d in have_digs}
+    fresh_digs = list()
+    pis = [(path, sha) for sha, path in htop.items() if sha not in htod]
+    for path, sha in pis:
+        if path in sniffed:
+            _, size, mime, desc = sniffed[path]
+            dig = Digest(id=sha, size=size, mime=mime, magic=desc)
+        else:
+            dig = make_one(path, sha)
         htod[sha] = dig
-        fresh_objs.append(dig)
-
-        # Attribute and Thumb are based on content
-        attrs = rattrs.make_some([(path, sha)])
-        fresh_objs += attrs
-        thumbs = rthumbs.make_some([(path, sha)])
-        fresh_objs += thumbs
-
-    if fresh_objs:
-        session.add_all(fresh_objs)
-        session.flush()             # to resolve fresh ids
+        fresh_digs.append(dig)
+    profile.count("digests cached", len(htop) - len(pis))
+    profile.count("digests new", len(pis))
+
+    if pis:
+        # Attribute and Thumb are based on content.  Each is a
+        # batched stage spread over all workers.  Thumbs in a store
+        # are instead made on first use.
+        with profile.stage("digest.attrs"):
+            attrs = rattrs.make(pis, nproc)
+        thumbs = list()
+        if "thumbs" not in session.info:
+            with profile.stage("digest.thumbs"):
+                thumbs = rthumbs.make(pis, nproc)
+
+        # Perceptual hashes come from the thumbnails when there are
+        # some, else from the images.
+        with profile.stage("digest.phash"):
+            hashes = rphash.from_thumbs(thumbs)
+            rest = [(path, sha) for path, sha in pis if sha not in hashes
+                    and (htod[sha].mime or "").startswith("image/")]
+            hashes.update(rphash.make(rest, nproc))
+        for dig in fresh_digs:
+            dig.phash = hashes.get(dig.id, None)
+
+        # Fresh rows are written in bulk, not through the ORM.  The
+        # fresh Digest objects are left out of the session.
+        with profile.stage("digest.insert"):
+            insert(session, Digest, fresh_digs)
+            insert(session, Attribute, attrs)
+            insert(session, Thumb, thumbs)
 
     order = [htod[ptoh[p]] for p in paths]
     return order
 
-def build(session, paths, nproc=1, force=False):
+def build(session, paths, nproc=1, force=False, xattr=False):
     '''
     Return Digests associated with paths.  
 
     Will ingest any that are not known.
 
-    If force is True, force a cache update for existing digests.
+    If force is True, rehash files even if their cached stat signature
+    shows them unchanged.  See fresh() for xattr.
     '''
     paths = [os.path.abspath(p) for p in paths]
-    digs = fresh(session, paths, nproc)
+    digs = fresh(session, paths, nproc, force, xattr)
     shas = [d.id for d in digs]
-    got = rpaths.fresh(session, zip(paths, shas))
-    session.commit()
+    with profile.stage("paths.fresh"):
+        got = rpaths.fresh(session, zip(paths, shas))
+    with profile.stage("db.commit"):
+        session.commit()
+
+    # The commit expired digs, reload them all at once.
+    with profile.stage("digest.load"):
+        return load(session, shas)
 
-    return digs
+
+def load(session, shas):
+    '''
+    Return Digests for shas, in order, loaded with one query.
+    '''
+    q = inchunks(session.query(Digest), Digest.id, shas)
+    byid = {d.id: d for d in q}
+    return [byid[sha] for sha in shas]
 
 
 def asdict(dig):
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''
+Find files of identical content.
+
+Candidates are winnowed in tiers of increasing cost: equal size, then
+equal hash of head and tail and only then equal full hash.  Most files
+are never read and most of the rest only in part.
+'''
+import os
+from functools import partial
+from rephile.jobs import pmapgroup
+import rephile.files as rfiles
+import rephile.paths as rpaths
+
+
+def groups(keys, items):
+    'Return lists of items sharing a key, dropping lone items'
+    ret = dict()
+    for key, item in zip(keys, items):
+        ret.setdefault(key, list()).append(item)
+    return [g for g in ret.values() if len(g) > 1]
+
+
+def find(session, files, nproc=1, xattr=False):
+    '''
+    Return list of (sha, size, paths) for content in more than one file.
+
+    Files in the cache with an unchanged stat signature are not hashed
+    in full.  Largest content comes first.  See
+    rephile.files.xattr_get() for xattr.
+    '''
+    size = dict()
+    for path in files:
+        path = os.path.abspath(path)
+        try:
+            size[path] = os.stat(path).st_size
+        except OSError:
+            continue
+    cands = groups(size.values(), size)
+
+    known = rpaths.known(session, [p for g in cands for p in g])
+    need = [p for g in cands if any(p not in known for p in g) for p in g]
+    parts = dict(zip(need, pmapgroup(rfiles.headtail, need, nproc)))
+
+    tohash = list()
+    for grp in cands:
+        if all(p in known for p in grp):
+            continue
+        for sub in groups([parts[p] for p in grp], grp):
+            tohash += [p for p in sub if p not in known]
+    sha = dict(known)
+    hss = pmapgroup(partial(rfiles.hashsize, xattr=xattr), tohash, nproc,
+                    [size[p] for p in tohash])
+    for path, hs in zip(tohash, hss):
+        sha[path] = hs[0]
+
+    paths = [p for g in cands for p in g if p in sha]
+    ret = [(sha[g[0]], size[g[0]], g)
+           for g in groups([sha[p] for p in paths], paths)]
+    ret.sort(key=lambda one: (-one[1], one[0]))
+    return ret
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''
+Persistent exiftool processes.
+
+Starting exiftool (Perl) costs far more than reading the EXIF of one
+photo.  An ExifTool keeps one "exiftool -stay_open True -@ -" process
+running and feeds it batches of files.  Use get() for the one shared
+by all callers in the current process, which gives one exiftool per
+job slot when run under rephile.jobs.
+'''
+import os
+import json
+import atexit
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+
+
+class ExifTool:
+    '''
+    A long-lived exiftool process.
+    '''
+
+    def __init__(self, executable="exiftool", batch=100):
+        self.executable = executable
+        self.batch = batch
+        self.proc = None
+        self.count = 0
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        'Start the exiftool process, if not already running'
+        if self.running:
+            return
+        self.close()
+        self.proc = Popen([self.executable, "-stay_open", "True", "-@", "-"],
+                          stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+
+    def close(self, timeout=5):
+        'Ask exiftool to exit, kill it if it does not'
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.write(b"-stay_open\nFalse\n")
+            proc.stdin.close()
+            proc.wait(timeout)
+        except (OSError, ValueError, TimeoutExpired):
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+    def execute(self, *args):
+        '''
+        Run one exiftool command with args and return its output.
+        '''
+        self.start()
+        self.count += 1
+        ready = b"{ready%d}" % self.count
+        lines = [os.fsencode(a) for a in args]
+        lines.append(b"-execute%d" % self.count)
+        self.proc.stdin.write(b"\n".join(lines) + b"\n")
+        self.proc.stdin.flush()
+        out = list()
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise OSError("exiftool exited unexpectedly")
+            if line.rstrip() == ready:
+                return b"".join(out)
+            out.append(line)
+
+    def json(self, files):
+        '''
+        Return list of EXIF dicts, one for each file in order.
+
+        Files are sent to exiftool in batches.  A file exiftool does
+        not report on gives an empty dict.  A crashed exiftool is
+        restarted and its batch retried once.
+        '''
+        files = list(files)
+        ret = list()
+        for ind in range(0, len(files), self.batch):
+            chunk = files[ind:ind + self.batch]
+            try:
+                out = self.execute("-j", *chunk)
+            except (OSError, ValueError):
+                self.close()
+                out = self.execute("-j", *chunk)
+            dats = json.loads(out) if out.strip() else []
+            byfile = {d.get("SourceFile"): d for d in dats}
+            ret += [byfile.get(f, dict()) for f in chunk]
+        return ret
+
+
+_tool = None
+_pid = None
+
+def get():
+    '''
+    Return the ExifTool of the current process, starting it if needed.
+
+    A forked child does not reuse its parent's instance.
+    '''
+    global _tool, _pid
+    if _tool is None or _pid != os.getpid():
+        _tool = ExifTool()
+        _pid = os.getpid()
+    return _tool
+
+
+@atexit.register
+def _close():
+    if _tool is not None and _pid == os.getpid():
+        _tool.close()
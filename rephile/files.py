@@ -4,11 +4,13 @@ Low level operations on files.
 '''
 import os
 import io
-import magic
+import string
 import hashlib
-from PIL import Image
-from subprocess import run
-import json
+import threading
+from fnmatch import fnmatch
+import rephile.exiftool
+import rephile.annex
+from rephile import profile
 
 def exif(files):
     '''
@@ -17,6 +19,8 @@ def exif(files):
     Order of input is retained on output.  
 
     If "files" is a scalar, it's considered a list of one.
+
+    A persistent exiftool process is reused across calls.
     '''
     if not files:
         return ()
@@ -24,10 +28,8 @@ def exif(files):
         files = [files]
     else:
         files=list(files)
-    cmd = ["exiftool", "-j"] + files
-    out = run(cmd, capture_output=True)
-    text = out.stdout.decode()
-    dats = json.loads(text)
+    with profile.stage("files.exif"):
+        dats = rephile.exiftool.get().json(files)
     for dat in dats:
         for omit in [
                 "SourceFile",
@@ -40,48 +42,257 @@ def exif(files):
                 "FileInodeChangeDate",
                 "FilePermissions",
                 "FileTypeExtension"]:
-            dat.pop(omit)
+            dat.pop(omit, None)
     return dats
 
 
 
 
+def walk(roots, include=(), exclude=()):
+    '''
+    Generate paths of files under roots.
+
+    A root that is a directory is descended with os.scandir, else it
+    is generated as-is.  Descended files are generated if their name
+    matches any include glob (or there are none) and no exclude glob.
+    Directories matching an exclude glob are skipped.  Symbolic links
+    to directories are not followed.  A directory's files are sorted
+    by name and come before its subdirectories.
+    '''
+    def keep(name, globs):
+        return any(fnmatch(name, g) for g in globs)
+
+    for root in roots:
+        if not os.path.isdir(root):
+            yield root
+            continue
+        todo = [root]
+        while todo:
+            with os.scandir(todo.pop()) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            subdirs = list()
+            for entry in entries:
+                if keep(entry.name, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if entry.is_dir():  # link to directory
+                    continue
+                if include and not keep(entry.name, include):
+                    continue
+                yield entry.path
+            todo += reversed(subdirs)
+
+
+# Size of the buffer used to stream file content through the hasher.
+blocksize = 1<<20
+
+# Each thread keeps a buffer for reuse by blocks().
+_local = threading.local()
+
+def blocks(fname):
+    '''
+    Generate successive blocks of file content.
+
+    Each block is a memoryview into a buffer reused by later calls in
+    the same thread so memory use does not grow with file size.  A
+    block is only valid until the next one is read or the generator
+    is closed.  The buffer is held by one call at a time so threads
+    and interleaved calls do not share it.
+    '''
+    buf = _local.__dict__.pop("buffer", None)
+    if buf is None or len(buf) != blocksize:
+        buf = bytearray(blocksize)
+    view = memoryview(buf)
+    try:
+        with open(fname, 'rb', buffering=0) as fp:
+            while True:
+                n = fp.readinto(buf)
+                if not n:
+                    break
+                profile.count("bytes read", n)
+                yield view[:n]
+    finally:
+        _local.buffer = buf
+
+
 def hash_one(fname):
+    'Return hash of file'
+    return hashsize_one(fname)[0]
+
+def hashsize_one(fname, xattr=False):
+    '''
+    Return tuple of hash and size.
+
+    For a file in git-annex they are taken from its key instead.  See
+    xattr_get() for xattr.
+    '''
+    return _hashsniff(fname, False, xattr)[:2]
+
+def sniff_one(fname, xattr=False):
+    '''
+    Return tuple of hash, size, mime type and magic description.
+
+    The file is opened and read once.  The types are taken from its
+    first block as it streams through the hasher.  They are None for
+    a file in git-annex whose content is absent.  See xattr_get() for
+    xattr.
+    '''
+    return _hashsniff(fname, True, xattr)
+
+def _hashsniff(fname, sniff, xattr):
+    got = rephile.annex.link(fname)
+    if got and not (sniff and os.path.exists(fname)):
+        return got + (None, None)
+    s = None
+    if xattr and not got:
+        s = os.stat(fname)
+        if xattr != "write":
+            got = xattr_get(fname, s)
+            profile.count("xattr hits" if got else "xattr misses")
+            if got and not sniff:
+                return got + (None, None)
     h1 = hashlib.sha256()
-    fp = open(fname, 'rb')
-    data = fp.read()
     size = 0
-    while len(data) > 0:
-        size += len(data)
-        h1.update(data)
-        data = fp.read()
-    fp.close()
-    return h1.hexdigest()
+    types = (None, None)
+    for block in blocks(fname):
+        if not size:
+            if sniff:
+                types = _types(block)
+            if got:
+                return got + types
+            got = rephile.annex.pointer(block)
+            if got:
+                return got + (None, None)
+        size += len(block)
+        h1.update(block)
+    if sniff and not size:
+        types = _types(b"")
+    sha = h1.hexdigest()
+    if s is not None:
+        xattr_set(fname, sha, s)
+    return (sha, size) + types
 
-def hashsize_one(fname):
-    'Return tuple of hash and size'
-    h1 = hashlib.sha256()
+# Extended attribute caching "<sha256> <size> <mtime_ns>" of a file.
+xattr_name = "user.rephile.sha256"
 
-    fp = open(fname, 'rb')
-    data = fp.read()
-    size = 0
-    while len(data) > 0:
-        size += len(data)
-        h1.update(data)
-        data = fp.read()
-    fp.close()
-    return (h1.hexdigest(), size)
-    
-def hashsize(files):
+def xattr_get(fname, s=None):
+    '''
+    Return (sha, size) cached in an extended attribute of file or None.
+
+    The cache is valid only if it holds a SHA-256 (64 hex digits) and
+    the size and modification time in nanoseconds of the stat result
+    s (or the file now) match those recorded.  The attribute is kept by cp -a, rsync -X and the like
+    so hashes can follow files between caches and hosts.
+
+    Functions taking xattr read and write this cache if it is True,
+    only write it if it is "write" and neither if it is False.
+    '''
+    try:
+        val = os.getxattr(fname, xattr_name).decode()
+        sha, size, mtime = val.split()
+        if len(sha) != 64 or sha.strip(string.hexdigits):
+            return None
+        sha = sha.lower()
+        s = s or os.stat(fname)
+        if int(size) == s.st_size and int(mtime) == s.st_mtime_ns:
+            return (sha, s.st_size)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+def xattr_set(fname, sha, s):
+    '''
+    Cache hash of file with the stat result s taken before hashing.
+
+    Nothing is cached if the file changed since s or can not take
+    extended attributes.
+    '''
+    val = f"{sha} {s.st_size} {s.st_mtime_ns}".encode()
+    try:
+        now = os.stat(fname)
+        if (now.st_size, now.st_mtime_ns) != (s.st_size, s.st_mtime_ns):
+            return
+        os.setxattr(fname, xattr_name, val)
+    except (OSError, AttributeError):
+        return
+    profile.count("xattr writes")
+
+def hashsize(files, xattr=False):
     'Map hashsize_one onto list of files'
     if isinstance(files, str):
         files = [files]
-    return [hashsize_one(f) for f in files]
+    with profile.stage("files.hash"):
+        return [hashsize_one(f, xattr) for f in files]
+
+# Size of each of the head and tail of a file read by headtail_one().
+partsize = 1<<16
+
+def headtail_one(fname):
+    '''
+    Return hash of the first and last partsize bytes of a file.
+
+    This is cheap to compute and tells apart most files of equal size.
+    '''
+    h1 = hashlib.sha256()
+    with open(fname, 'rb') as fp:
+        head = fp.read(partsize)
+        h1.update(head)
+        profile.count("bytes read", len(head))
+        size = fp.seek(0, os.SEEK_END)
+        if size > partsize:
+            fp.seek(max(partsize, size - partsize))
+            tail = fp.read(partsize)
+            h1.update(tail)
+            profile.count("bytes read", len(tail))
+    return h1.hexdigest()
+
+def headtail(files):
+    'Map headtail_one onto list of files'
+    return [headtail_one(f) for f in files]
+
+def sniff(files, xattr=False):
+    'Map sniff_one onto list of files'
+    with profile.stage("files.hash"):
+        return [sniff_one(f, xattr) for f in files]
+
+def sizes(files):
+    'Return sizes of files, zero for any that can not be stat\'ed'
+    ret = list()
+    for path in files:
+        try:
+            ret.append(os.stat(path).st_size)
+        except OSError:
+            ret.append(0)
+    return ret
+
+_magics = None
+_magics_pid = None
+
+def magics():
+    '''
+    Return (mime, description) magic.Magic pair for this process.
+
+    Making a libmagic handle loads its database, so one pair is made
+    per worker process and reused for every file.
+    '''
+    global _magics, _magics_pid
+    if _magics is None or _magics_pid != os.getpid():
+        import magic
+        _magics = (magic.Magic(mime=True), magic.Magic())
+        _magics_pid = os.getpid()
+    return _magics
+
+def _types(data):
+    mime, desc = magics()
+    data = bytes(data)
+    return (mime.from_buffer(data), desc.from_buffer(data))
 
 def mime_one(path):
-    return magic.from_file(path, mime=True)
+    return magics()[0].from_file(path)
 def magic_one(path):
-    return magic.from_file(path)
+    return magics()[1].from_file(path)
 
 def info(files):
     if isinstance(files, str):
@@ -93,35 +304,132 @@ def info(files):
             ext=os.path.splitext(path)[1][1:],
             realpath=rpath,
             abspath=os.path.abspath(path),
-            magic=magic.from_file(rpath),
-            mime=magic.from_file(rpath, mime=True))
+            magic=magic_one(rpath),
+            mime=mime_one(rpath))
         ret.append(dat)
     return ret
 
 
+def _fit(size, box):
+    'Return size scaled down to fit in box, keeping aspect ratio'
+    scale = min(box[0]/size[0], box[1]/size[1])
+    return (max(1, round(size[0]*scale)), max(1, round(size[1]*scale)))
+
+def preview(img, size):
+    '''
+    Return the EXIF embedded preview of JPEG img if it can make a
+    thumbnail of size, else None.
+
+    The preview must have the aspect ratio of img and not be smaller
+    than the thumbnail would be.
+    '''
+    if img.format != "JPEG":
+        return None
+    from PIL import Image, ExifTags
+    raw = img.info.get("exif", b"")
+    if not raw.startswith(b"Exif\x00\x00"):
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        start = ifd1[0x0201]    # JPEGInterchangeFormat
+        length = ifd1[0x0202]   # JPEGInterchangeFormatLength
+        pimg = Image.open(io.BytesIO(raw[6+start:6+start+length]))
+        pimg.load()
+    except Exception:           # a preview is only ever a shortcut
+        return None
+    want = _fit(img.size, size)
+    if pimg.size[0] < want[0] or pimg.size[1] < want[1]:
+        return None
+    # Allow the preview a pixel of rounding in its shape.
+    (pw, ph), (iw, ih) = pimg.size, img.size
+    if abs(pw*ih - ph*iw) > max(iw, ih):
+        return None
+    return pimg
+
+def thumbnails(path, sizes=((128,128), (256,256), (512,512))):
+    '''
+    Return list of thumbnail images of path, one per size.
+
+    Sizes are boxes in increasing order.  They stop at the first one
+    larger than the image.  The largest thumbnail is made from the
+    EXIF preview if that is big enough, else from the image decoded
+    with JPEG DCT-domain downscaling.  Each smaller one is made from
+    the next larger.
+    '''
+    from PIL import Image
+    full = Image.open(path)
+    fits = list()
+    for size in sizes:
+        if size[0] > full.size[0] or size[1] > full.size[1]:
+            break
+        fits.append(size)
+    if not fits:
+        return []
+
+    # Image.thumbnail() on the not yet loaded image uses Image.draft()
+    # so that a JPEG is decoded at reduced scale.
+    img = preview(full, fits[-1]) or full
+    ret = list()
+    for size in reversed(fits):
+        if ret:
+            img = img.copy()
+        img.thumbnail(size)
+        ret.append(img)
+    ret.reverse()
+    return ret
+
 def thumb(files, sizes=((128,128), (256,256), (512,512))):
     '''
     Generate thumbnails.  
 
     Return a list with per-file entries.
 
-    Each entry is a dictionary keyed by size tuple.
+    Each entry is a dictionary keyed by size tuple.  A file that is
+    not an image has an empty dictionary.
     '''
     if isinstance(files, str):
         files = [files]
     ret = list()
-    for path in files:
-        one = dict()
-        full = Image.open(path)
-        for size in sizes:
-            if size[0] > full.size[0] or size[1] > full.size[1]:
-                break
-            img = full.copy()
-            img.thumbnail(size)
-            with io.BytesIO() as output:
-                img.save(output, format="PNG")
-                dat = output.getvalue()
-                one[img.size] = dat
-        ret.append(one)
+    with profile.stage("files.thumb"):
+        for path in files:
+            one = dict()
+            try:
+                imgs = thumbnails(path, sizes)
+            except (OSError, SyntaxError, ValueError):
+                imgs = []
+            for img in imgs:
+                with io.BytesIO() as output:
+                    img.save(output, format="PNG")
+                    dat = output.getvalue()
+                    one[img.size] = dat
+            ret.append(one)
+    return ret
+
+def dhash(img, size=8):
+    '''
+    Return the difference hash of an image as a size*size bit integer.
+
+    Each bit is whether a pixel is brighter than its right neighbour
+    in a grey (size+1)x(size) shrink of the image.  It changes little
+    when the image is resized, re-encoded or its metadata changes.
+    '''
+    from PIL import Image
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = small.tobytes()
+    ret = 0
+    for row in range(size):
+        for col in range(size):
+            ind = row*(size + 1) + col
+            ret = (ret << 1) | (px[ind] > px[ind + 1])
     return ret
 
+def dhash_one(path):
+    'Return difference hash of image file or None if not an image'
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            # decode a JPEG at reduced scale
+            img.draft("L", (64, 64))
+            return dhash(img)
+    except (OSError, SyntaxError, ValueError):
+        return None
@@ -2,25 +2,32 @@
 
 import imgur_uploader as imup
 import urllib
+from functools import lru_cache
 
-def upload(fname):
+@lru_cache(maxsize=None)
+def client():
     '''
-    Upload file name to imgur, return URL
+    Return (client, anon) from imgur-uploader config or None
     '''
     # this is basically imgur-uploader's main command
     config = imup.get_config()
-    #print(config)
     if not config:
         return
     if "refresh_token" in config:
-        client = imup.ImgurClient(config["id"], config["secret"], refresh_token=config["refresh_token"])
-        anon = False
-        #print ("refreshed token", client)
-    else:
-        #print ("connect with secret")
-        client = imup.ImgurClient(config["id"], config["secret"])
-        anon = True
+        return (imup.ImgurClient(config["id"], config["secret"],
+                                 refresh_token=config["refresh_token"]), False)
+    return (imup.ImgurClient(config["id"], config["secret"]), True)
+
 
-    response = client.upload_from_path(fname, anon=anon)
+def upload(fname, http=None):
+    '''
+    Upload file name to imgur, return URL
+
+    The imgur client makes its own connections so http is not used.
+    '''
+    got = client()
+    if not got:
+        return
+    imgur, anon = got
+    response = imgur.upload_from_path(fname, anon=anon)
     return response.get("link", None)
-    
@@ -2,24 +2,203 @@
 '''
 Tooling for running multiprocessing
 '''
+import time
+import atexit
 import multiprocessing
+from contextlib import contextmanager
+
+from .util import chunkify, flatten, partition
+from rephile import profile
+
+
+def _callgroup(task):
+    meth, inds, group = task
+    return inds, meth(group)
+
+
+def _profiled(task):
+    '''
+    Call meth on arg in a worker, return result and profile snapshot.
+    '''
+    meth, arg = task
+    func = arg[0] if meth is _callgroup else meth
+    # a functools.partial is named by its function
+    name = getattr(func, "func", func).__name__
+    profile.enable()
+    profile.reset()
+    with profile.stage("worker:" + name):
+        got = meth(arg)
+    snap = profile.snapshot()
+    profile.reset()
+    return got, snap
+
+
+def _unprofiled(results):
+    '''
+    Generate results from _profiled, merging each snapshot.
+    '''
+    for got, snap in results:
+        profile.merge(snap)
+        busy = sum(v[1] for k, v in snap["stages"].items()
+                   if k.startswith("worker:"))
+        profile.count("worker seconds busy", busy)
+        yield got
+
+
+class Pool:
+    '''
+    A reusable pool of worker processes.
+
+    Workers are started on first use and kept until close() so that
+    many calls pay for process startup only once.  With nproc of 1
+    everything runs in the calling process.
+    '''
+
+    # Weighted work is split into this many groups per worker.
+    oversplit = 4
+
+    def __init__(self, nproc=1):
+        self.nproc = nproc
+        self._pool = None
+
+    @property
+    def pool(self):
+        'The underlying multiprocessing pool, started if needed'
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(processes=self.nproc)
+        return self._pool
+
+    @property
+    def inline(self):
+        return self.nproc <= 1
+
+    def map(self, meth, lst):
+        '''
+        Return list of meth called on each element of lst.
+        '''
+        if self.inline:
+            return [meth(one) for one in lst]
+        if profile.enabled:
+            with _available(self.nproc):
+                return list(_unprofiled(self.pool.map(
+                    _profiled, [(meth, one) for one in lst])))
+        return self.pool.map(meth, lst)
+
+    def imap(self, meth, lst, chunksize=1):
+        '''
+        Generate meth called on each element of lst, in order.
+        '''
+        if self.inline:
+            return map(meth, lst)
+        if profile.enabled:
+            return _unprofiled(self.pool.imap(
+                _profiled, [(meth, one) for one in lst], chunksize))
+        return self.pool.imap(meth, lst, chunksize)
+
+    def imap_unordered(self, meth, lst, chunksize=1):
+        '''
+        Generate meth called on each element of lst as each finishes.
+        '''
+        if self.inline:
+            return map(meth, lst)
+        if profile.enabled:
+            return _unprofiled(self.pool.imap_unordered(
+                _profiled, [(meth, one) for one in lst], chunksize))
+        return self.pool.imap_unordered(meth, lst, chunksize)
+
+    def mapgroup(self, meth, lst, weights=None):
+        '''
+        Run meth on groups of elements in lst, return flat list.
+
+        Without weights, lst is split into one group per worker of
+        equal count.  With weights (eg, file sizes) lst is split into
+        several groups per worker of about equal total weight.  The
+        heaviest groups are sent first and idle workers take the next
+        group as they finish.  Results are in the order of lst.
+        '''
+        lst = list(lst)
+        if not lst:
+            return []
+        if self.inline:
+            return list(meth(lst))
+        if weights is None:
+            groups = chunkify(lst, self.nproc)
+            return flatten(self.map(meth, groups))
+
+        parts = partition(list(weights), self.nproc * self.oversplit)
+        tasks = [(meth, part, [lst[ind] for ind in part]) for part in parts]
+        ret = [None] * len(lst)
+        with _available(self.nproc):
+            for inds, got in self.imap_unordered(_callgroup, tasks):
+                for ind, one in zip(inds, got):
+                    ret[ind] = one
+        return ret
+
+    def close(self):
+        'Stop the workers after they finish outstanding work'
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        pool.close()
+        pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def _available(nproc):
+    '''
+    Count seconds nproc workers are available while in this context.
+    '''
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.count("worker seconds available",
+                      nproc * (time.perf_counter() - t0))
+
+
+_pools = dict()
+
+def pool(nproc):
+    '''
+    Return a Pool for nproc.
+
+    If nproc is already a Pool it is returned, otherwise a Pool shared
+    by all callers asking for the same number of processes.
+    '''
+    if isinstance(nproc, Pool):
+        return nproc
+    got = _pools.get(nproc, None)
+    if got is None:
+        got = _pools[nproc] = Pool(nproc)
+    return got
+
+
+@atexit.register
+def shutdown():
+    'Close all shared pools'
+    while _pools:
+        _pools.popitem()[1].close()
 
-from .util import chunkify, flatten
 
 def pmap(meth, lst, nproc=1):
     '''
     Call meth on each element of lst.
+
+    The nproc may be a number of processes or a Pool.
     '''
-    pool = multiprocessing.Pool()
-    pool = multiprocessing.Pool(processes=nproc)
-    answer = pool.map(meth, lst)
-    pool.close()
-    return answer
+    return pool(nproc).map(meth, lst)
 
-def pmapgroup(meth, lst, nproc):
+def pmapgroup(meth, lst, nproc, weights=None):
     '''
     Run meth on groups of elements in lst
+
+    The nproc may be a number of processes or a Pool.  See
+    Pool.mapgroup() for weights.
     '''
-    groups = chunkify(lst, nproc)
-    got = pmap(meth, groups, nproc)
-    return flatten(got)
+    return pool(nproc).mapgroup(meth, lst, weights)
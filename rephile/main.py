@@ -6,53 +6,219 @@ Methods of these classes do high level operations.  They deal in
 
 '''
 import os
-from rephile import db as rdb
-from rephile.jobs import pmapgroup
-import rephile.files
-import rephile.digest
-import rephile.tags
+from rephile.jobs import Pool, pmapgroup
+from rephile.util import batched
+
+# The CLI is run many times from scripts so modules which import
+# SQLAlchemy, PIL or libmagic are imported where they are used.
 
 class Rephile:
 
-    def __init__(self, cache, nproc=1):
+    def __init__(self, cache, nproc=1, thumbs=None, xattr=False):
+        '''
+        If thumbs is a directory, thumbnails are kept there as image
+        files made on first use instead of in the cache at ingest.
+
+        If xattr is True, file hashes are also cached in extended
+        attributes of the files (see rephile.files.xattr_get()).
+        '''
         self.cache = cache
         self.nproc = nproc
-        
+        self.pool = Pool(nproc)
+        self.thumbs = thumbs
+        self.xattr = xattr
+
+    def close(self):
+        'Release worker processes and the database session'
+        self.pool.close()
+        ses = getattr(self, '_session', None)
+        if ses:
+            ses.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     @property
     def session(self):
         ses = getattr(self, '_session', None)
         if ses: return ses
-        self._session = rdb.session(self.cache)
+        import rephile.db
+        import rephile.thumbs
+        self._session = rephile.db.session(self.cache)
+        if self.thumbs:
+            self._session.info["thumbs"] = rephile.thumbs.Store(self.thumbs)
         return self._session
 
     def init(self):
         'Explicitly initialize the database'
-        rdb.init(self.cache)
+        import rephile.db
+        rephile.db.init(self.cache)
 
     def exif(self, files):
         'Return EXIF info from files as dict'
-        return pmapgroup(rephile.files.exif, files, self.nproc)
+        import rephile.files
+        return pmapgroup(rephile.files.exif, files, self.pool)
         
     def hashsize(self, files):
         'Return (hash,size) tuples for files'
-        hss = pmapgroup(rephile.files.hashsize, files, self.nproc)
+        import rephile.files
+        from functools import partial
+        hss = pmapgroup(partial(rephile.files.hashsize, xattr=self.xattr),
+                        files, self.pool,
+                        rephile.files.sizes(files))
         return hss
 
     def digest(self, paths, force=False):        
         '''
         Return Digest objects matching paths.
         '''
-        return rephile.digest.build(self.session, paths, self.nproc, force)
+        import rephile.digest
+        return rephile.digest.build(self.session, paths, self.pool, force,
+                                    self.xattr)
         
-    def paths(self, files, force=False):
+    def ingest(self, roots, include=(), exclude=(), batch=1000, force=False):
+        '''Generate lists of (path, Digest) while ingesting files.
+
+        Files and files found under directories in roots (see
+        rephile.files.walk()) are ingested in batches of size batch.
+        Each batch is committed as it finishes and is released from
+        the session once the caller has had it so that memory does
+        not grow with the number of files.
+        '''
+        import rephile.files
+        files = rephile.files.walk(roots, include, exclude)
+        for chunk in batched(files, batch):
+            digs = self.digest(chunk, force)
+            yield list(zip(chunk, digs))
+            self.session.expunge_all()
+
+    def paths(self, files, force=False, thumbs=False):
         '''
         Return Path objects matching files.
+
+        Their digests and attributes (and thumbs if thumbs is True)
+        are loaded in bulk.
         '''
+        import rephile.paths
         files = [os.path.abspath(f) for f in files]
-        digs = self.digest(files, force)
-        shas = [d.id for d in digs]
-        return rephile.paths.fresh(self.session, zip(files, shas))
+        self.digest(files, force)
+        return rephile.paths.load(self.session, files, thumbs)
         
+    def make(self, files, format, method="copy", nthreads=8,
+             dry_run=False, force=False):
+        '''Make new files from old, return the plan.
+
+        Target file names are format applied to file information.
+        The whole plan is made, and checked for collisions, before any
+        file is made.  See rephile.refile.
+        '''
+        import rephile.refile
+        paths = self.paths(files, force)
+        steps = rephile.refile.plan(paths, format, method)
+        if not dry_run:
+            rephile.refile.run(steps, nthreads)
+        return steps
+
+    def upload(self, files, service, nthreads=4, again=False, force=False):
+        '''Return list of (Path, URL or None) for files uploaded.
+
+        Service is "imgur" or "0x0".  Content is uploaded once and its
+        URL kept in the cache unless again is True.  See
+        rephile.upload.
+        '''
+        import rephile.upload
+        if service == "imgur":
+            from rephile.imgur import upload
+        elif service == "0x0":
+            from rephile.ohecksoh import upload
+        else:
+            raise ValueError(f"unknown upload service: {service}")
+        paths = self.paths(files, force)
+        urls = rephile.upload.run(self.session, paths, service, upload,
+                                  nthreads, again)
+        return list(zip(paths, urls))
+
+    def dupes(self, roots, include=(), exclude=()):
+        '''Return list of (sha, size, paths) for duplicated content.
+
+        Files are found under roots as in ingest().  Only files of
+        equal size and partial content are hashed in full.  See
+        rephile.dupes.
+        '''
+        import rephile.files
+        import rephile.dupes
+        files = rephile.files.walk(roots, include, exclude)
+        return rephile.dupes.find(self.session, files, self.pool,
+                                  self.xattr)
+
+    def similar(self, files, k=8, force=False, fill=False):
+        '''Return list of similar images for each file.
+
+        Each is a list of (distance, Digest) for cached images with
+        perceptual hash within Hamming distance k of the file's, the
+        nearest first.  A file that is not an image has none.
+
+        If fill is True, first hash cached images lacking a perceptual
+        hash, as in a cache made before them.  See rephile.phash.fill().
+        '''
+        import rephile.digest
+        import rephile.phash
+        digs = self.digest(files, force)
+        if fill:
+            rephile.phash.fill(self.session, self.pool)
+        index = rephile.phash.Index.load(self.session)
+        near = [index.near(d.phash, k) if d.phash is not None else []
+                for d in digs]
+        byid = {d.id: d for d in rephile.digest.load(
+            self.session, {i for one in near for _, i in one})}
+        return [[(dist, byid[i]) for dist, i in one] for one in near]
+
+    def find(self, *preds):
+        '''Return Digests with attributes matching all predicates.
+
+        A predicate is text like "ISO>3200" or a (name, op, value)
+        tuple.  See rephile.attrs.query().
+        '''
+        import rephile.attrs
+        return rephile.attrs.query(self.session, *preds).all()
+
+    def tagged(self, tag, transitive=True):
+        '''Return Digests tagged with tag (a Tag or name).
+
+        If transitive, include digests tagged with tags under tag.
+        '''
+        import rephile.tags
+        return rephile.tags.digests(self.session, tag, transitive).all()
+
+    def tag(self, files, *names, force=False):
+        '''Tag files with all tags of given names.
+
+        Missing tags are made.  All edges are made in one transaction.
+        '''
+        import rephile.tags
+        digs = self.digest(files, force)
+        rephile.tags.tag(self.session, [d.id for d in digs], names)
+
+    def untag(self, files, *names, force=False):
+        'Remove tags of given names from files'
+        import rephile.tags
+        digs = self.digest(files, force)
+        rephile.tags.untag(self.session, [d.id for d in digs], names)
+
+    def tagnames(self, files, force=False):
+        '''Return list of tag names for each file.
+
+        These are the tags put directly on the files.
+        '''
+        import rephile.tags
+        digs = self.digest(files, force)
+        got = rephile.tags.names(self.session, [d.id for d in digs])
+        return [got.get(d.id, []) for d in digs]
+
     def tags(self, *args, assure=False, **kwds):
         '''Return tag objects matching tag name strings.
 
@@ -60,6 +226,7 @@ class Rephile:
         Otherwise, return tags in args.
 
         '''
+        import rephile.tags
         if assure or kwds:
             rephile.tags.add(self.session, *args, **kwds)
             args = list(set(list(args) + list(kwds.keys())))
@@ -9,15 +9,23 @@ url = 'https://0x0.st/'
 #url = 'http://localhost:5000'
 # see below for local 0x0.st setup
 
-def upload(fname):
+def upload(fname, http=None, timeout=60):
     '''
-    Upload file to 0x0.st, return file name or None on fail
+    Upload file to 0x0.st, return URL or None on fail
 
     curl -F'file=@yourfile.png' https://0x0.st
+
+    The http session (see rephile.upload.http()) is used if given.
     '''
-    files = {"file": open(fname, 'rb')}
-    got = requests.post(url, files=files)
-    return got.text
+    http = http or requests
+    try:
+        with open(fname, 'rb') as fp:
+            got = http.post(url, files={"file": fp}, timeout=timeout)
+    except requests.RequestException:
+        return None
+    if not got.ok:
+        return None
+    return got.text.strip() or None
 
 
 
@@ -3,22 +3,53 @@
 Medium level operations on Path
 '''
 import os
-from rephile.dbtypes import Path
+import socket
+from sqlalchemy.orm import selectinload
+from rephile.dbtypes import Path, Digest, Annex, Collection
 from rephile.jobs import pmapgroup
-from datetime import datetime
+from rephile.db import inchunks, insert
+from datetime import datetime, timedelta
+import rephile.annex as rannex
+from rephile import profile
 
-def make_one(filename, did):
-    s = os.stat(filename)
+def stat(filename):
+    'Return stat of file, or of the link itself if its target is absent'
+    try:
+        return os.stat(filename)
+    except FileNotFoundError:
+        return os.lstat(filename)
+
+def mtime(s):
+    'Return modification time of stat result exact to the microsecond'
+    sec, ns = divmod(s.st_mtime_ns, 1000000000)
+    return datetime.fromtimestamp(sec) + timedelta(microseconds=ns//1000)
+
+def signature(s):
+    'Return the signature of a stat result as recorded by Path.signature'
+    return (s.st_size, s.st_ino, mtime(s))
+
+def restat(pobj, s):
+    'Set the stat derived fields of a Path from a stat result'
+    pobj.mode = s.st_mode
+    pobj.uid = s.st_uid
+    pobj.gid = s.st_gid
+    pobj.atime = datetime.fromtimestamp(s.st_atime)
+    pobj.mtime = mtime(s)
+    pobj.ctime = datetime.fromtimestamp(s.st_ctime)
+    pobj.size = s.st_size
+    pobj.inode = s.st_ino
+    return pobj
+
+def make_one(filename, did, s=None):
+    '''
+    Return a new Path for filename with digest ID did.
+
+    The stat result s is taken if given.
+    '''
     p = Path(id=os.path.abspath(filename),
              real = os.path.realpath(filename),
-             mode = s.st_mode,
-             uid = s.st_uid, 
-             gid = s.st_gid, 
-             atime = datetime.fromtimestamp(s.st_atime),
-             mtime = datetime.fromtimestamp(s.st_mtime),
-             ctime = datetime.fromtimestamp(s.st_ctime),
              digest_id = did)
-    return p
+    return restat(p, s or stat(filename))
 
 def make_some(pis):
     ret = list()
@@ -39,32 +70,108 @@ def ids(session, filenames):
     return byp
 
 
+def known(session, filenames):
+    '''Return map from filename to digest ID for files unchanged on disk.
+
+    A file is unchanged if its current stat signature matches the one
+    recorded in its Path.
+    '''
+    have = inchunks(session.query(Path), Path.id, filenames)
+    ret = dict()
+    for pobj in have:
+        if pobj.digest_id is None:
+            continue
+        try:
+            s = stat(pobj.id)
+        except OSError:
+            continue
+        if pobj.signature == signature(s):
+            ret[pobj.id] = pobj.digest_id
+    return ret
+
+
+def collections(session, filenames):
+    '''Return map from filename to ID of the Collection of its git-annex.
+
+    Annex and Collection rows are made as needed.  Files not in a
+    git-annex are absent.
+    '''
+    tops = {f: rannex.toplevel(os.path.dirname(f)) for f in filenames}
+    tops = {f: t for f, t in tops.items() if t}
+    host = socket.gethostname()
+    cids = dict()
+    for top in set(tops.values()):
+        uuid = rannex.uuid(top)
+        annex = session.query(Annex).filter_by(uuid=uuid).first()
+        if annex is None:
+            annex = Annex(uuid=uuid)
+            session.add(annex)
+            session.flush()
+        coll = session.query(Collection).filter_by(host=host, base=top).first()
+        if coll is None:
+            coll = Collection(name=os.path.basename(top), host=host,
+                              base=top, annex_id=annex.id)
+            session.add(coll)
+            session.flush()
+        cids[top] = coll.id
+    return {f: cids[t] for f, t in tops.items()}
+
+
 def fresh(session, fname_hashes):
-    '''Make new Paths for any we don't have'''
+    '''Make new Paths for any we don't have.
+
+    Paths with a changed digest or stat signature are rewritten.  All
+    are written in bulk.  Return the Paths in order.
+    '''
     fname_hashes = list(fname_hashes)
     fnames = [ph[0] for ph in fname_hashes]
 
-    have_fnames = session.query(Path).filter(Path.id.in_(fnames)).all()
+    have_fnames = inchunks(session.query(Path), Path.id, fnames)
     have_fnames = {p.id:p for p in have_fnames}
 
+    cids = collections(session, fnames)
+
     ret = list()
     fresh_paths = list()
     for fname, sha in fname_hashes:
         have = have_fnames.get(fname, None)
-        if have is None:
-            have = make_one(fname, sha)
-            fresh_paths.append(have)
+        s = stat(fname)
+        cid = cids.get(fname, None)
+        if have is not None and have.digest_id == sha \
+           and have.signature == signature(s) \
+           and have.collection_id == cid:
             ret.append(have)
             continue
-        ret.append(have)
-        if have.digest_id != sha:
-            have.digest_id = sha
-            fresh_paths.append(have)
-    if fresh_paths:
-        session.bulk_save_objects(fresh_paths)
+        pobj = make_one(fname, sha, s)
+        pobj.collection_id = cid
+        fresh_paths.append(pobj)
+        if have is None:
+            ret.append(pobj)
+        else:
+            session.expire(have)  # reload after the update
+            ret.append(have)
+    insert(session, Path, fresh_paths, update=True)
     return ret
         
 
+
+def load(session, filenames, thumbs=False):
+    '''
+    Return Paths for filenames, in order.
+
+    Each Path's Digest and that Digest's attributes and paths (and
+    thumbs if thumbs is True) are loaded up front with a fixed number
+    of queries instead of lazily one query per object.
+    '''
+    dig = selectinload(Path.digest)
+    opts = [dig.selectinload(Digest.attrs), dig.selectinload(Digest.paths)]
+    if thumbs:
+        opts.append(dig.selectinload(Digest.thumbs))
+    q = inchunks(session.query(Path).options(*opts), Path.id, filenames)
+    with profile.stage("paths.load"):
+        byid = {p.id: p for p in q}
+    return [byid[f] for f in filenames]
+
     
 def asdict(pobj):
     ret = dict()
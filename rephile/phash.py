@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''
+Medium-level operations on perceptual hashes of images.
+
+The perceptual hash of a Digest is the 64 bit difference hash of its
+image (see rephile.files.dhash).  Copies of an image which have been
+resized, re-encoded or stripped of metadata have hashes a small
+Hamming distance apart.
+'''
+import io
+from sqlalchemy import select, update
+
+from rephile.dbtypes import Digest, Path
+from rephile.jobs import pmapgroup
+from rephile.files import dhash, dhash_one
+from rephile import profile
+
+bits = 64
+mask = (1 << bits) - 1
+
+
+def signed(h):
+    'Return hash h as fits an SQLite integer'
+    if h is None:
+        return None
+    return h - (1 << bits) if h >> (bits - 1) else h
+
+
+def unsigned(h):
+    'Return hash h as stored by signed() back as unsigned'
+    return h & mask
+
+
+def from_thumbs(thumbs):
+    '''
+    Return dict from digest ID to perceptual hash made from Thumbs.
+
+    The smallest thumbnail of each digest is used.
+    '''
+    small = dict()
+    for trow in thumbs:
+        have = small.get(trow.digest_id, None)
+        if have is None or trow.width < have.width:
+            small[trow.digest_id] = trow
+    from PIL import Image
+    ret = dict()
+    for did, trow in small.items():
+        with Image.open(io.BytesIO(trow.image)) as img:
+            ret[did] = signed(dhash(img))
+    return ret
+
+
+def make_some(pis):
+    '''
+    Return list of (digest ID, perceptual hash) from (path, digest ID).
+
+    Paths which are not images are skipped.
+    '''
+    ret = list()
+    with profile.stage("files.phash"):
+        for path, did in pis:
+            h = dhash_one(path)
+            if h is not None:
+                ret.append((did, signed(h)))
+    return ret
+
+
+def make(pis, nproc=1):
+    return pmapgroup(make_some, pis, nproc)
+
+
+def fill(session, nproc=1):
+    '''
+    Set perceptual hash on image Digests lacking one, eg in old caches.
+
+    Images which can not be decoded still lack one after.  This is
+    run only when asked for as it tries them each time.
+    '''
+    q = select(Digest.id, Path.id).join(Path, Path.digest_id == Digest.id) \
+        .where(Digest.phash.is_(None), Digest.mime.like("image/%"))
+    pis = dict()
+    for did, path in session.execute(q):
+        pis.setdefault(did, path)
+    got = make([(p, d) for d, p in pis.items()], nproc)
+    if got:
+        session.execute(update(Digest),
+                        [dict(id=did, phash=h) for did, h in got])
+    session.commit()
+
+
+class Index:
+    '''
+    Search perceptual hashes by Hamming distance.
+
+    Distances to all hashes are computed at once with NumPy if it is
+    available, else one by one in Python.
+    '''
+
+    def __init__(self, ids, hashes):
+        self.ids = list(ids)
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self.numpy = numpy
+        if numpy:
+            self.hashes = numpy.array(list(hashes), dtype=numpy.int64) \
+                               .view(numpy.uint64)
+        else:
+            self.hashes = [unsigned(h) for h in hashes]
+
+    @classmethod
+    def load(cls, session):
+        'Return Index of all Digests with a perceptual hash'
+        q = select(Digest.id, Digest.phash).where(Digest.phash.is_not(None))
+        rows = session.execute(q).all()
+        return cls([r[0] for r in rows], [r[1] for r in rows])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, h):
+        'Return sequence of distances from hash h to all in the index'
+        h = unsigned(h)
+        if self.numpy is None:
+            return [bin(one ^ h).count("1") for one in self.hashes]
+        np = self.numpy
+        xor = self.hashes ^ np.uint64(h)
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(xor)
+        table = np.array([bin(b).count("1") for b in range(256)],
+                         dtype=np.uint8)
+        return table[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+    def near(self, h, k=8):
+        '''
+        Return list of (distance, digest ID) within distance k of hash h.
+
+        Nearest come first.
+        '''
+        dists = self.distances(h)
+        if self.numpy is None:
+            hits = [i for i, d in enumerate(dists) if d <= k]
+        else:
+            hits = self.numpy.nonzero(dists <= k)[0]
+        ret = [(int(dists[i]), self.ids[i]) for i in hits]
+        ret.sort()
+        return ret
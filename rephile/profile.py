@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+Optional profiling of rephile stages.
+
+When enabled, stage() times named stages in wall and CPU seconds and
+count() adds to named counters.  When not enabled (the default) each
+is one test of a global flag.  Work done by worker processes is
+collected back to the main process by rephile.jobs.
+'''
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+enabled = False
+
+# name -> [calls, wall, cpu]
+stages = dict()
+counters = dict()
+
+_start = None
+_null = nullcontext()
+
+
+def enable(on=True):
+    'Turn profiling on (or off)'
+    global enabled, _start
+    enabled = on
+    if on and _start is None:
+        _start = (time.perf_counter(), time.process_time())
+
+
+def reset():
+    'Forget all stages and counters'
+    stages.clear()
+    counters.clear()
+
+
+def count(name, num=1):
+    'Add num to counter name'
+    if enabled:
+        counters[name] = counters.get(name, 0) + num
+
+
+def stage(name):
+    'Return a context manager timing stage name'
+    if not enabled:
+        return _null
+    return _timer(name)
+
+
+@contextmanager
+def _timer(name):
+    w0 = time.perf_counter()
+    c0 = time.process_time()
+    try:
+        yield
+    finally:
+        one = stages.setdefault(name, [0, 0.0, 0.0])
+        one[0] += 1
+        one[1] += time.perf_counter() - w0
+        one[2] += time.process_time() - c0
+
+
+def snapshot():
+    'Return stages and counters as plain data'
+    return dict(stages={k: list(v) for k, v in stages.items()},
+                counters=dict(counters))
+
+
+def merge(snap):
+    'Add a snapshot (eg from a worker) to the stages and counters'
+    for name, (calls, wall, cpu) in snap["stages"].items():
+        one = stages.setdefault(name, [0, 0.0, 0.0])
+        one[0] += calls
+        one[1] += wall
+        one[2] += cpu
+    for name, num in snap["counters"].items():
+        counters[name] = counters.get(name, 0) + num
+
+
+def report():
+    '''
+    Return dict of profile results.
+
+    Stages run in workers are named "worker:<stage>" and their times
+    summed over all workers.  Worker utilisation is the fraction of
+    the time the workers were available that they were busy.
+    '''
+    ret = dict(stages={k: dict(calls=v[0], wall=v[1], cpu=v[2])
+                       for k, v in sorted(stages.items())},
+               counters=dict(sorted(counters.items())))
+    if _start:
+        ret["total"] = dict(wall=time.perf_counter() - _start[0],
+                            cpu=time.process_time() - _start[1])
+    avail = counters.get("worker seconds available", 0)
+    if avail:
+        ret["utilisation"] = counters.get("worker seconds busy", 0) / avail
+    return ret
+
+
+def text(rep=None):
+    'Return the report as lines of text'
+    rep = rep or report()
+    lines = [f"{'stage':32} {'calls':>8} {'wall':>10} {'cpu':>10}"]
+    for name, one in rep["stages"].items():
+        lines.append(f"{name:32} {one['calls']:8} "
+                     f"{one['wall']:10.3f} {one['cpu']:10.3f}")
+    if "total" in rep:
+        lines.append(f"{'total':32} {'':8} {rep['total']['wall']:10.3f} "
+                     f"{rep['total']['cpu']:10.3f}")
+    for name, num in rep["counters"].items():
+        if isinstance(num, float):
+            num = f"{num:.3f}"
+        lines.append(f"{name:32} {num:>8}")
+    if "utilisation" in rep:
+        lines.append(f"{'worker utilisation':32} {rep['utilisation']:8.1%}")
+    return "\n".join(lines)
+
+
+def dump(fname):
+    'Write the report as JSON to file fname'
+    with open(fname, "w") as fp:
+        json.dump(report(), fp, indent=4)
+        fp.write("\n")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+'''
+Plan and carry out making new files from old.
+
+A plan is a list of Step.  It is made in full before any file is
+touched so that target collisions are found up front.  Sources with
+identical content are made once and the rest hard linked to it.
+'''
+import os
+import errno
+import shutil
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from rephile.paths import asdict
+
+# Linux ioctl to share the extents of one file with another (reflink)
+FICLONE = 0x40049409
+
+methods = ("copy", "move", "hard", "soft")
+
+# What a step does.  Method is one of methods, "same" if source is
+# target or "exists" if target exists, and nothing is done for these
+# last two.  If dup is not None it is the target of an earlier step
+# with identical content, which is hard linked to instead.
+Step = namedtuple("Step", "method src tgt dup", defaults=(None,))
+
+
+def plan(paths, format, method="copy"):
+    '''
+    Return list of Step to make files from Path objects.
+
+    Each target file name is format applied to the asdict() of a path.
+    A ValueError is raised if different content would make the same
+    target.
+    '''
+    if method not in methods:
+        raise ValueError(f"unknown make method: {method}")
+    steps = list()
+    made = dict()               # target -> digest ID
+    first = dict()              # digest ID -> target of first step
+    collide = list()
+    for pobj in paths:
+        src = pobj.id
+        tgt = os.path.abspath(format.format_map(asdict(pobj)))
+        did = pobj.digest_id
+        if tgt in made:
+            if made[tgt] != did:
+                collide.append(tgt)
+            continue
+        made[tgt] = did
+        if tgt == os.path.abspath(src):
+            steps.append(Step("same", src, tgt))
+            continue
+        if os.path.lexists(tgt):
+            steps.append(Step("exists", src, tgt))
+            continue
+        if method in ("copy", "move") and did in first:
+            steps.append(Step(method, src, tgt, first[did]))
+            continue
+        first[did] = tgt
+        steps.append(Step(method, src, tgt))
+    if collide:
+        some = ", ".join(collide[:3])
+        raise ValueError(f"{len(collide)} targets from differing content: {some}")
+    return steps
+
+
+def copyfile(src, tgt):
+    '''
+    Copy contents of file src to new file tgt as cheaply as possible.
+
+    A reflink is tried first, then copy_file_range() and finally a
+    plain copy.  The target appears only once complete.
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(tgt),
+                               prefix=".rephile-")
+    try:
+        with open(src, "rb") as sfp, os.fdopen(fd, "wb") as tfp:
+            size = os.fstat(sfp.fileno()).st_size
+            _copyfd(sfp.fileno(), tfp.fileno(), size)
+        shutil.copymode(src, tmp)
+        os.replace(tmp, tgt)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _copyfd(sfd, tfd, size):
+    try:
+        import fcntl
+        fcntl.ioctl(tfd, FICLONE, sfd)
+        return
+    except (ImportError, OSError):
+        pass
+    if hasattr(os, "copy_file_range"):
+        try:
+            done = 0
+            while done < size:
+                got = os.copy_file_range(sfd, tfd, size - done)
+                if got == 0:
+                    break
+                done += got
+            return
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP):
+                raise
+            os.lseek(sfd, 0, os.SEEK_SET)
+            os.lseek(tfd, 0, os.SEEK_SET)
+            os.ftruncate(tfd, 0)
+    with open(sfd, "rb", closefd=False) as sfp, \
+         open(tfd, "wb", closefd=False) as tfp:
+        shutil.copyfileobj(sfp, tfp, 1<<20)
+
+
+def copy(src, tgt):
+    'Copy src to tgt, copying a symlink as a symlink'
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), tgt)
+    else:
+        copyfile(src, tgt)
+
+
+def move(src, tgt):
+    'Move src to tgt, copying if on another file system'
+    try:
+        os.rename(src, tgt)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        copy(src, tgt)
+        shutil.copystat(src, tgt, follow_symlinks=False)
+        os.remove(src)
+
+
+def soft(src, tgt):
+    'Symlink tgt to src'
+    if os.path.islink(src):
+        os.symlink(os.path.realpath(src), tgt)
+    else:
+        os.symlink(os.path.abspath(src), tgt)
+
+
+def hard(src, tgt):
+    'Hard link tgt to src'
+    os.link(src, tgt)
+
+
+def dedup(step):
+    'Hard link step target to its dup, removing a moved source'
+    try:
+        os.link(step.dup, step.tgt)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        ops[step.method](step.src, step.tgt)
+        return
+    if step.method == "move":
+        os.remove(step.src)
+
+
+ops = dict(copy=copy, move=move, soft=soft, hard=hard)
+
+
+def run(steps, nthreads=8):
+    '''
+    Carry out a plan with up to nthreads concurrent file operations.
+
+    Directories are made first and links to identical content last.
+    '''
+    steps = [s for s in steps if s.method in ops]
+    for one in sorted({os.path.dirname(s.tgt) for s in steps}):
+        os.makedirs(one, exist_ok=True)
+    with ThreadPoolExecutor(max(1, nthreads)) as pool:
+        list(pool.map(lambda s: ops[s.method](s.src, s.tgt),
+                      [s for s in steps if s.dup is None]))
+        list(pool.map(dedup, [s for s in steps if s.dup is not None]))
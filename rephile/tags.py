@@ -8,17 +8,19 @@ its tag.
 
 from itertools import product
 
-# fixme: this is for upsert.  One day, maybe something besides sqlite is used.
-from sqlalchemy.dialects.sqlite import insert as upsert
+from sqlalchemy import select, delete, true
+from sqlalchemy.orm import aliased
 
-from rephile.dbtypes import Tag, Digest, TagTagEdge, DigestTagEdge
+from rephile.db import inchunks, insert, upsert, maxvars
+from rephile.dbtypes import Tag, Digest, TagTagEdge, DigestTagEdge, \
+    TagClosure
 from rephile.util import is_sequence
 
 def get(session, *names):
     '''
     Return tags objects with given names.
     '''
-    return session.query(Tag).filter(Tag.name.in_(names)).all()
+    return list(inchunks(session.query(Tag), Tag.name, names))
 
 def add(session, *args, **kwds):
     '''Add some tags.
@@ -30,18 +32,74 @@ def add(session, *args, **kwds):
 
     '''
     if args:
-        stmt = upsert(Tag).values([dict(name=n) for n in args])
-        stmt = stmt.on_conflict_do_nothing(index_elements=[Tag.name])
-        session.execute(stmt)
+        insert(session, Tag, [dict(name=n) for n in args], index=["name"])
     if kwds:
-        stmt = upsert(Tag).values([dict(name=n, description=d)
-                                   for n,d in kwds.items()])
-        stmt = stmt.on_conflict_do_update(
-            index_elements=[Tag.name],
-            set_=dict(description=stmt.excluded.description))
-        session.execute(stmt)        
+        insert(session, Tag, [dict(name=n, description=d)
+                              for n,d in kwds.items()],
+               update=["description"], index=["name"])
     session.commit()
     
+def ids(session, names, assure=False):
+    '''
+    Return dict mapping tag names to tag IDs in one query.
+
+    If assure is True, missing tags are first made.  Otherwise,
+    unknown names are absent from the dict.
+    '''
+    names = list(set(names))
+    if assure:
+        insert(session, Tag, [dict(name=n) for n in names], index=["name"])
+    q = session.query(Tag.name, Tag.id)
+    return dict(inchunks(q, Tag.name, names))
+
+
+def tag(session, shas, names):
+    '''
+    Tag digests given by ID with all tags of the given names.
+
+    Missing tags are made and existing edges are left as is.  Edges
+    are written in bulk and committed together.
+    '''
+    tids = ids(session, names, assure=True)
+    shas = set(shas)
+    insert(session, DigestTagEdge,
+           [dict(digest_id=d, tag_id=t)
+            for d,t in product(shas, tids.values())],
+           index=["digest_id", "tag_id"])
+    close(session, [], tids.values())
+    session.commit()
+
+
+def untag(session, shas, names):
+    '''
+    Remove tags of the given names from digests given by ID.
+    '''
+    tids = list(ids(session, names).values())
+    shas = list(set(shas))
+    if tids:
+        for ind in range(0, len(shas), maxvars):
+            session.execute(delete(DigestTagEdge).where(
+                DigestTagEdge.tag_id.in_(tids),
+                DigestTagEdge.digest_id.in_(shas[ind:ind + maxvars])))
+    session.commit()
+
+
+def names(session, shas):
+    '''
+    Return dict mapping digest ID to sorted list of its tag names.
+
+    Digests without tags are absent.
+    '''
+    q = session.query(DigestTagEdge.digest_id, Tag.name).join(
+        Tag, Tag.id == DigestTagEdge.tag_id)
+    ret = dict()
+    for did, name in inchunks(q, DigestTagEdge.digest_id, list(shas)):
+        ret.setdefault(did, list()).append(name)
+    for lst in ret.values():
+        lst.sort()
+    return ret
+
+
 # fixme: this is a dumb name.
 def birth(session, parents, children):
     '''
@@ -55,23 +113,90 @@ def birth(session, parents, children):
     '''
     if not is_sequence(parents):
         parents = [parents]
-    ptags = [p for p in parents if isinstance(p,Tag)]
-    pstrs = [p for p in parents if isinstance(p,str)]
-    if pstrs:
-        ptags += get(session, pstrs)
+    ptids = [p.id for p in parents if isinstance(p,Tag)]
+    ptids += ids(session, [p for p in parents if isinstance(p,str)]).values()
 
     if not is_sequence(children):
         children = [children]
-    cdigs = [p for p in children if isinstance(p,Digest)]
-    ctags = [p for p in children if isinstance(p,Tag)]
-    cstrs = [p for p in children if isinstance(p,str)]
-    if cstrs:
-        ctags += get(session, cstrs)
+    cdids = [p.id for p in children if isinstance(p,Digest)]
+    ctids = [p.id for p in children if isinstance(p,Tag)]
+    ctids += ids(session, [p for p in children if isinstance(p,str)]).values()
+
+    if cdids:
+        # digests may be new to the session
+        session.flush()
+    insert(session, TagTagEdge,
+           [dict(tail_id=c, head_id=p) for c,p in product(ctids, ptids)],
+           index=["tail_id", "head_id"])
+    insert(session, DigestTagEdge,
+           [dict(digest_id=d, tag_id=t) for d,t in product(cdids, ptids)],
+           index=["digest_id", "tag_id"])
+    close(session, list(product(ctids, ptids)), ptids + ctids)
+    session.commit()
+
+
+def close(session, edges, tags=()):
+    '''
+    Update the tag closure for new (child ID, parent ID) tag edges.
+
+    Everything under the child becomes under everything the parent is
+    under.  Tags given by ID in tags and in edges are assured to be in
+    the closure.
+    '''
+    ids = set(tags) | {t for edge in edges for t in edge}
+    insert(session, TagClosure, [dict(ancestor_id=t, descendant_id=t)
+                                 for t in ids])
+    anc = aliased(TagClosure)
+    des = aliased(TagClosure)
+    for child, parent in edges:
+        sel = select(anc.ancestor_id, des.descendant_id).join_from(
+            anc, des, true()).where(
+                anc.descendant_id == parent, des.ancestor_id == child)
+        stmt = upsert(TagClosure).from_select(
+            ["ancestor_id", "descendant_id"], sel).on_conflict_do_nothing()
+        session.execute(stmt)
+
 
-    tte = [TagTagEdge(c,p) for c,p in product(ctags, ptags)]
-    dte = [DigestTagEdge(d,t) for d,t in product(cdigs, ptags)]
+def reclose(session):
+    '''
+    Rebuild the tag closure from the tag edges.
 
-    session.add_all(tte + dte)
+    This is done when a cache made before the closure is upgraded.
+    '''
+    session.execute(delete(TagClosure))
+    ids = [t for (t,) in session.query(Tag.id)]
+    insert(session, TagClosure, [dict(ancestor_id=t, descendant_id=t)
+                                 for t in ids])
+    up = select(TagTagEdge.tail_id.label("descendant_id"),
+                TagTagEdge.head_id.label("ancestor_id")).cte(recursive=True)
+    up = up.union(select(up.c.descendant_id, TagTagEdge.head_id).where(
+        TagTagEdge.tail_id == up.c.ancestor_id))
+    stmt = upsert(TagClosure).from_select(
+        ["descendant_id", "ancestor_id"],
+        # SQLite needs a WHERE to tell ON CONFLICT from a join ON.
+        select(up.c.descendant_id, up.c.ancestor_id).where(true())
+    ).on_conflict_do_nothing()
+    session.execute(stmt)
     session.commit()
 
 
+def digests(session, tag, transitive=True):
+    '''
+    Return query of Digests tagged with tag (a Tag or name).
+
+    If transitive, digests tagged with any tag under tag are included.
+    This is one indexed query whatever the depth of the tag graph.
+    '''
+    if isinstance(tag, str):
+        tid = select(Tag.id).where(Tag.name == tag).scalar_subquery()
+    else:
+        tid = tag.id
+    q = session.query(Digest).join(
+        DigestTagEdge, DigestTagEdge.digest_id == Digest.id)
+    if not transitive:
+        return q.filter(DigestTagEdge.tag_id == tid)
+    return q.join(
+        TagClosure, TagClosure.descendant_id == DigestTagEdge.tag_id).filter(
+            TagClosure.ancestor_id == tid).distinct()
+
+
@@ -2,10 +2,20 @@
 '''
 Medium-level operations on thumbs
 '''
+import os
+import tempfile
 
 from rephile.dbtypes import Thumb
 from rephile.jobs import pmapgroup
-from rephile.files import thumb as gen_thumbs
+from rephile.files import thumb as gen_thumbs, thumbnails
+
+# Freedesktop size labels and their bounding boxes
+fdboxes = {
+    "normal": (128, 128),
+    "large": (256, 256),
+    "x-large": (512, 512),
+    "xx-large": (1024, 1024),
+}
 
 
 def make_some(pis):
@@ -26,3 +36,83 @@ def make_some(pis):
 
 def make(pis, nproc=1):
     return pmapgroup(make_some, pis, nproc)
+
+
+class Store:
+    '''
+    Thumbnail image files in a directory, eg next to the cache.
+
+    Files are at <base>/<fdsize>/<digest>.<ext> in the spirit of the
+    freedesktop thumbnail spec but keyed by content digest.
+    '''
+
+    exts = dict(jpeg="jpg", webp="webp")
+
+    def __init__(self, base, format="jpeg", quality=85):
+        if format not in self.exts:
+            raise ValueError(f"unsupported thumbnail format: {format}")
+        self.base = os.path.abspath(base)
+        self.format = format
+        self.quality = quality
+
+    def path(self, sha, fdsize):
+        'Return file name for the thumbnail of digest sha'
+        return os.path.join(self.base, fdsize,
+                            sha + "." + self.exts[self.format])
+
+    def get(self, sha, fdsize):
+        'Return file name if the thumbnail exists, else None'
+        path = self.path(sha, fdsize)
+        if os.path.exists(path):
+            return path
+
+    def put(self, sha, fdsize, img):
+        'Write image as thumbnail of digest sha, return its file name'
+        path = self.path(sha, fdsize)
+        pdir = os.path.dirname(path)
+        os.makedirs(pdir, exist_ok=True)
+        if self.format == "jpeg" and img.mode != "RGB":
+            img = img.convert("RGB")
+        fd, tmp = tempfile.mkstemp(dir=pdir)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                img.save(fp, format=self.format, quality=self.quality)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return path
+
+
+def lazy(dig, fdsize, store):
+    '''
+    Return a Thumb of size fdsize for Digest dig from the store.
+
+    The thumbnail image file is generated from one of the digest's
+    paths if not yet in the store.  The Thumb is not added to the
+    database.  None is returned if no thumbnail can be made or
+    fdsize is not one of fdboxes (eg "xxx-large").
+    '''
+    box = fdboxes.get(fdsize, None)
+    if box is None:
+        return None
+    fname = store.get(dig.id, fdsize)
+    if fname is None:
+        for pobj in dig.paths:
+            if not os.path.exists(pobj.id):
+                continue
+            try:
+                imgs = thumbnails(pobj.id, [box])
+            except (OSError, SyntaxError, ValueError):
+                continue
+            if imgs:
+                fname = store.put(dig.id, fdsize, imgs[0])
+            break
+    if fname is None:
+        return None
+    from PIL import Image
+    with Image.open(fname) as img:
+        width, height = img.size
+    trow = Thumb(width=width, height=height, digest_id=dig.id)
+    trow.file = fname
+    return trow
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''
+Upload file content to web services, once per digest.
+
+Uploads run concurrently in a bounded number of threads sharing one
+pooled HTTP session which retries failed requests with backoff.  The
+URL of each upload is kept in the cache as an Upload so content
+already uploaded to a service is not uploaded to it again.  Caches
+made before Upload get its table from rephile.db.upgrade().
+'''
+import sys
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from rephile.dbtypes import Upload
+from rephile.db import inchunks, insert
+
+# HTTP status which are worth retrying.  Only refusals are, as a POST
+# failing after it was taken may have stored the file.
+retry_status = (429,)
+
+
+def http(retries=3, backoff=0.5, nconn=8):
+    '''
+    Return a requests.Session with nconn pooled connections per host.
+
+    Requests, including POST, are retried up to retries times with
+    exponential backoff starting at backoff seconds if they could not
+    connect or were refused with a retry_status.  Other failures, such
+    as read timeouts and server errors, are not retried so an upload
+    is not made twice.
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(total=retries, read=0, other=0, backoff_factor=backoff,
+                  status_forcelist=retry_status, allowed_methods=None,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=nconn,
+                          pool_maxsize=nconn)
+    ses = requests.Session()
+    ses.mount("http://", adapter)
+    ses.mount("https://", adapter)
+    return ses
+
+
+def known(session, shas, service):
+    'Return dict from sha to URL of uploads of shas to service'
+    q = inchunks(session.query(Upload).filter(Upload.service == service),
+                 Upload.digest_id, shas)
+    return {u.digest_id: u.url for u in q}
+
+
+def attempt(upload, fname, ses):
+    '''
+    Return URL from upload(fname, ses) or None if it fails or raises.
+
+    An exception is reported on stderr.
+    '''
+    try:
+        return upload(fname, ses)
+    except Exception as err:
+        sys.stderr.write(f"upload of {fname} failed: {err!r}\n")
+        return None
+
+
+def run(session, paths, service, upload, nthreads=4, again=False):
+    '''
+    Return list of URL, or None if failed, of Path objects uploaded.
+
+    The function upload(file name, http session) uploads one file to
+    service and returns its URL or None.  Content with a recorded
+    upload is not uploaded again unless again is True.  Paths sharing
+    content share one upload.  A failed upload does not stop others
+    and those which succeed are recorded.
+    '''
+    htop = dict()
+    for path in paths:
+        htop.setdefault(path.digest_id, path.id)
+    urls = dict()
+    if not again:
+        urls = known(session, list(htop), service)
+    todo = [(sha, fname) for sha, fname in htop.items() if sha not in urls]
+    if todo:
+        ses = http(nconn=max(1, nthreads))
+        with ses, ThreadPoolExecutor(max(1, nthreads)) as pool:
+            got = pool.map(lambda one: attempt(upload, one[1], ses), todo)
+            got = list(got)
+        now = datetime.now()
+        rows = [dict(digest_id=sha, service=service, url=url, time=now)
+                for (sha, _), url in zip(todo, got) if url]
+        insert(session, Upload, rows, update=["url", "time"])
+        session.commit()
+        urls.update((r["digest_id"], r["url"]) for r in rows)
+    return [urls.get(p.digest_id, None) for p in paths]
@@ -2,6 +2,7 @@
 '''
 Generic utility
 '''
+import heapq
 from math import ceil
 import collections.abc
 
@@ -15,6 +16,32 @@ def chunkify(things, nchunks):
     for ind in range(0, len(things), nper):  
         yield things[ind:ind + nper] 
 
+def partition(weights, nparts):
+    '''Return lists of indices into weights with near equal total weight.
+
+    Heaviest elements are placed first, each into the lightest list.
+    Empty lists are dropped and the heaviest list comes first.
+    '''
+    parts = [(0, ind, list()) for ind in range(nparts)]
+    order = sorted(range(len(weights)), key=lambda i: weights[i], reverse=True)
+    for ind in order:
+        tot, pind, part = heapq.heappop(parts)
+        part.append(ind)
+        heapq.heappush(parts, (tot + weights[ind], pind, part))
+    parts.sort(reverse=True)
+    return [part for tot, pind, part in parts if part]
+
+def batched(things, size):
+    'Generate lists of up to size things, consuming things lazily'
+    batch = list()
+    for thing in things:
+        batch.append(thing)
+        if len(batch) == size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
 def flatten(chunks):
     'Return flat list from list of lists'
     return [y for x in chunks for y in x]
@@ -23,5 +50,5 @@ def is_sequence(obj):
     '''
     Return True if obj is sequence but not string.
     '''
-    if isinstance(obj, (str, bytes)): return true
+    if isinstance(obj, (str, bytes)): return False
     return isinstance(obj, collections.abc.Sequence)
@@ -19,6 +19,9 @@ setuptools.setup(
         "pillow",
         "requests",
     ],
+    extras_require = dict(
+        similar = ["numpy"],
+    ),
     entry_points = dict(
         console_scripts = [
             'rephile = rephile.__main__:main',
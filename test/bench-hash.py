@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+Benchmark file hashing: rephile's streaming hasher vs whole-file read.
+
+usage: bench-hash.py [size-in-MB] [directory]
+
+Each method runs in a fresh process so that its peak RSS can be
+reported along with the hash rate.
+'''
+import os
+import sys
+import time
+import json
+import hashlib
+import resource
+import tempfile
+import subprocess
+
+
+def readall(fname):
+    'The pre-streaming implementation, kept here for comparison'
+    h1 = hashlib.sha256()
+    fp = open(fname, 'rb')
+    data = fp.read()
+    size = 0
+    while len(data) > 0:
+        size += len(data)
+        h1.update(data)
+        data = fp.read()
+    fp.close()
+    return (h1.hexdigest(), size)
+
+
+def run_one(method, fname):
+    from rephile.files import hashsize_one
+    meth = dict(readall=readall, streaming=hashsize_one)[method]
+    t0 = time.perf_counter()
+    sha, size = meth(fname)
+    dt = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(dict(method=method, sha=sha, size=size, seconds=dt,
+                          mbps=size/dt/1e6, maxrss_kb=rss)))
+
+
+def make_file(fname, mb):
+    chunk = os.urandom(1<<20)
+    with open(fname, 'wb') as fp:
+        for _ in range(mb):
+            fp.write(chunk)
+
+
+def main(mb=256, tdir=None):
+    mb = int(mb)
+    with tempfile.TemporaryDirectory(dir=tdir) as tmp:
+        fname = os.path.join(tmp, "bench.dat")
+        make_file(fname, mb)
+        for method in ("readall", "streaming"):
+            out = subprocess.run([sys.executable, __file__, "--one",
+                                  method, fname],
+                                 capture_output=True, check=True)
+            dat = json.loads(out.stdout)
+            print("{method:10} {mbps:8.1f} MB/s {maxrss_kb:10d} kB peak RSS"
+                  .format(**dat))
+
+
+if '__main__' == __name__:
+    if sys.argv[1:2] == ["--one"]:
+        run_one(*sys.argv[2:4])
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''
+Benchmark writing Attribute rows: ORM add_all + flush vs db.insert.
+
+usage: bench-insert.py [ndigests] [nattrs] [directory]
+
+Like ingest, each digest gets nattrs attributes (about 150 for a
+typical photo).
+'''
+import os
+import sys
+import time
+import tempfile
+
+from rephile.db import session as make_session, insert
+from rephile.dbtypes import Digest, Attribute
+from rephile.attrs import typed
+
+
+def make_rows(ndigests, nattrs, tag):
+    digs = list()
+    attrs = list()
+    for ind in range(ndigests):
+        sha = f"{tag}{ind:060d}"
+        digs.append(Digest(id=sha, size=ind, mime="image/jpeg",
+                           magic="JPEG image data"))
+        for one in range(nattrs):
+            val = [one, one/3.0, "2019:06:01 12:00:00", f"text {one}"][one % 4]
+            attrs.append(Attribute(name=f"Attr{one}", digest_id=sha,
+                                   **typed(val)))
+    return digs, attrs
+
+
+def orm(ses, digs, attrs):
+    ses.add_all(digs + attrs)
+    ses.flush()
+
+
+def bulk(ses, digs, attrs):
+    insert(ses, Digest, digs)
+    insert(ses, Attribute, attrs)
+
+
+def main(ndigests=200, nattrs=150, tdir=None):
+    ndigests = int(ndigests)
+    nattrs = int(nattrs)
+    with tempfile.TemporaryDirectory(dir=tdir) as tmp:
+        for name, meth in [("orm", orm), ("bulk", bulk)]:
+            ses = make_session(os.path.join(tmp, name + ".db"))
+            digs, attrs = make_rows(ndigests, nattrs, name)
+            nrows = len(digs) + len(attrs)
+            t0 = time.perf_counter()
+            meth(ses, digs, attrs)
+            ses.commit()
+            dt = time.perf_counter() - t0
+            assert ses.query(Attribute).count() == len(attrs)
+            ses.close()
+            print(f"{name:5} {nrows} rows {dt:8.3f} s {nrows/dt:10.0f} rows/s")
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+'''
+Benchmark perceptual hash search.
+
+usage: bench-phash.py [nhashes] [nqueries]
+'''
+import sys
+import time
+import random
+
+from rephile.phash import Index, signed
+
+
+def main(nhashes=1000000, nqueries=10):
+    nhashes = int(nhashes)
+    nqueries = int(nqueries)
+    rng = random.Random(0)
+    hashes = [signed(rng.getrandbits(64)) for _ in range(nhashes)]
+    t0 = time.perf_counter()
+    index = Index(range(nhashes), hashes)
+    dt = time.perf_counter() - t0
+    print(f"build {nhashes} hashes {dt:8.3f} s")
+    for name in ("numpy", "python"):
+        if name == "python":
+            index.numpy = None
+            index.hashes = [h & ((1<<64)-1) for h in hashes]
+        elif index.numpy is None:
+            continue
+        t0 = time.perf_counter()
+        for h in hashes[:nqueries]:
+            index.near(h, 8)
+        dt = (time.perf_counter() - t0) / nqueries
+        print(f"{name:6} {dt*1000:8.1f} ms per query")
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
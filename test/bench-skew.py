@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+'''
+Benchmark count-based vs size-weighted work partitioning on a skewed
+corpus.
+
+usage: bench-skew.py [nproc] [scale-in-MB] [directory]
+
+The corpus mimics a photo directory with a few videos: many "JPEGs"
+of 3 scale units, some "RAWs" of 25 and two "videos" of 500.
+'''
+import os
+import sys
+import time
+import tempfile
+
+from rephile.jobs import Pool
+from rephile.files import hashsize, sizes
+from rephile.util import chunkify, partition
+
+
+def make_corpus(tmp, scale):
+    block = os.urandom(scale * 1024)
+    files = list()
+    for kind, count, units in [("jpg", 60, 3), ("raw", 20, 25),
+                               ("mov", 2, 500)]:
+        for ind in range(count):
+            fname = os.path.join(tmp, f"{kind}{ind:03d}.{kind}")
+            with open(fname, "wb") as fp:
+                for _ in range(units):
+                    fp.write(block)
+            files.append(fname)
+    # Interleave as a directory listing would.
+    files.sort(key=lambda f: os.path.basename(f)[3:])
+    return files
+
+
+def main(nproc=4, scale=1024, tdir=None):
+    nproc = int(nproc)
+    scale = int(scale)
+    with tempfile.TemporaryDirectory(dir=tdir) as tmp:
+        files = make_corpus(tmp, scale)
+        weights = sizes(files)
+        total = sum(weights)
+        ideal = total / nproc
+        counted = [sum(sizes(c)) for c in chunkify(files, nproc)]
+        weighted = [sum(weights[i] for i in p)
+                    for p in partition(weights, nproc)]
+        print(f"largest worker load / ideal: count {max(counted)/ideal:.2f}"
+              f" weighted {max(weighted)/ideal:.2f}")
+        with Pool(nproc) as pool:
+            pool.mapgroup(hashsize, files[:nproc])   # start workers
+            for name, wts in [("count", None),
+                                  ("weighted", weights)]:
+                t0 = time.perf_counter()
+                got = pool.mapgroup(hashsize, files, wts)
+                dt = time.perf_counter() - t0
+                assert len(got) == len(files)
+                print(f"{name:10} -j{nproc} {dt:8.3f} s "
+                      f"{total/dt/1e6:8.1f} MB/s")
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
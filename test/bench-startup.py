@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''
+Benchmark start up time of each rephile command.
+
+usage: bench-startup.py [budget-ms] [repeats]
+
+Each command is run with --help, and hashsize on a small file, in a
+fresh Python.  The best of repeats wall times is compared against the
+budget, less the time to start a bare Python.  The exit status is the
+number of commands over budget.
+'''
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from rephile.__main__ import cli
+
+
+def best(args, repeats):
+    ret = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        dt = time.perf_counter() - t0
+        ret = dt if ret is None else min(ret, dt)
+    return ret
+
+
+def main(budget=150, repeats=5):
+    budget = float(budget) / 1000
+    repeats = int(repeats)
+    bare = best([sys.executable, "-c", "pass"], repeats)
+    print(f"{'bare python':24} {bare*1000:8.1f} ms")
+    rephile = [sys.executable, "-m", "rephile"]
+    with tempfile.NamedTemporaryFile() as fp:
+        fp.write(b"x" * 1000)
+        fp.flush()
+        runs = [("--help", ["--help"]), ("hashsize", ["hashsize", fp.name])]
+        runs += [(f"{name} --help", [name, "--help"])
+                 for name in sorted(cli.commands)]
+        over = 0
+        for name, args in runs:
+            dt = best(rephile + args, repeats) - bare
+            bad = dt > budget
+            over += bad
+            print(f"{name:24} {dt*1000:8.1f} ms" + (" OVER BUDGET" if bad else ""))
+    return over
+
+
+if '__main__' == __name__:
+    sys.exit(main(*sys.argv[1:]))
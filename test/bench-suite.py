@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+'''
+Benchmark the ingest and output stages on a synthetic photo corpus.
+
+usage: bench-suite.py [options]   (see --help)
+
+Each stage is timed at each number of jobs and results are printed as
+JSON (or written to -o) so they may be compared between commits.
+Stages needing a missing external tool (exiftool) are recorded as
+skipped.
+'''
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+import click
+from click.testing import CliRunner
+
+import corpus
+from rephile.main import Rephile
+from rephile.jobs import pmapgroup
+from rephile.__main__ import cli
+import rephile.files
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Stages and the external programs they need
+needs = dict(hashsize=(), thumbs=(), exif=("exiftool",),
+             digest_cold=("exiftool",), digest_warm=("exiftool",),
+             lines=("exiftool",), render=("exiftool",),
+             asdata=("exiftool",), make=("exiftool",))
+
+
+def run_cli(*args):
+    # args are "-c cache -j jobs" then the command
+    got = CliRunner().invoke(cli, list(args), catch_exceptions=False)
+    if got.exit_code:
+        raise RuntimeError(f"rephile {args[4]} failed: {got.output}")
+
+
+# Stages run through the API, the rest through the CLI
+api = dict(
+    hashsize=lambda rep, files: rep.hashsize(files),
+    thumbs=lambda rep, files: pmapgroup(rephile.files.thumb, files, rep.pool),
+    exif=lambda rep, files: rep.exif(files),
+    digest_cold=lambda rep, files: rep.digest(files),
+    digest_warm=lambda rep, files: rep.digest(files))
+
+
+def stage(name, files, jobs, work):
+    '''
+    Run one stage, return seconds taken.
+    '''
+    cache = os.path.join(work, f"cache-{jobs}.db")
+    if name == "digest_cold" and os.path.exists(cache):
+        os.remove(cache)
+    if name in api:
+        with Rephile(cache, jobs) as rep:
+            if not rep.pool.inline:
+                rep.pool.pool   # start workers before timing
+            t0 = time.perf_counter()
+            api[name](rep, files)
+            return time.perf_counter() - t0
+
+    opts = ["-c", cache, "-j", str(jobs)]
+    t0 = time.perf_counter()
+    if name == "lines":
+        run_cli(*opts, "lines", "-f", "{digest_id} {id}", *files)
+    elif name == "render":
+        run_cli(*opts, "render", "-t",
+                os.path.join(here, "dump-digests.txt.j2"), *files)
+    elif name == "asdata":
+        run_cli(*opts, "asdata", *files)
+    elif name == "make":
+        out = os.path.join(work, f"made-{jobs}")
+        shutil.rmtree(out, ignore_errors=True)
+        run_cli(*opts, "make", "-f", out + "/{digest_id}.{ext}", *files)
+    else:
+        raise ValueError(f"unknown stage: {name}")
+    return time.perf_counter() - t0
+
+
+def commit():
+    try:
+        got = subprocess.run(["git", "-C", here, "rev-parse", "HEAD"],
+                             capture_output=True, text=True)
+    except OSError:
+        return None
+    return got.stdout.strip() or None
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option("-n", "--count", default=100, help="Number of files in corpus")
+@click.option("-m", "--megapixels", default=(1.0, 4.0), type=(float, float),
+              help="Range of photo sizes in megapixels")
+@click.option("--png", default=0.1, help="Fraction of PNG files")
+@click.option("--dups", default=0.1, help="Fraction of duplicate files")
+@click.option("--skew", default=0.0,
+              help="Fraction of files four times the largest size")
+@click.option("--seed", default=0, help="Corpus random seed")
+@click.option("-j", "--jobs", default="1,2,4",
+              help="Comma separated numbers of jobs to run")
+@click.option("-s", "--stages", default=",".join(needs),
+              help="Comma separated stages to run")
+@click.option("-d", "--directory", default=None,
+              help="Directory in which to make the corpus")
+@click.option("-o", "--output", default=None, type=click.Path(),
+              help="Write JSON results to this file instead of stdout")
+def main(count, megapixels, png, dups, skew, seed, jobs, stages,
+         directory, output):
+    'Time rephile stages on a synthetic corpus'
+    jobs = [int(j) for j in jobs.split(",")]
+    stages = stages.split(",")
+    params = dict(count=count, megapixels=megapixels, png=png, dups=dups,
+                  skew=skew, seed=seed)
+    results = list()
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        files = corpus.write_corpus(os.path.join(work, "corpus"), **params)
+        nbytes = sum(os.path.getsize(f) for f in files)
+        for name in stages:
+            missing = [n for n in needs[name] if not shutil.which(n)]
+            for njobs in jobs:
+                res = dict(stage=name, jobs=njobs, files=len(files),
+                           bytes=nbytes)
+                if missing:
+                    res["skipped"] = "missing " + ", ".join(missing)
+                else:
+                    res["seconds"] = stage(name, files, njobs, work)
+                results.append(res)
+                click.echo(f"{name:12} {njobs:3} " +
+                           (f"{res['seconds']:8.3f} s" if "seconds" in res
+                            else res["skipped"]), err=True)
+    text = json.dumps(dict(commit=commit(), python=platform.python_version(),
+                           platform=platform.platform(),
+                           cpus=os.cpu_count(), time=time.time(),
+                           corpus=params, results=results), indent=4)
+    if output:
+        with open(output, "w") as fp:
+            fp.write(text + "\n")
+    else:
+        click.echo(text)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+Benchmark per-image thumbnail time: rephile's thumbnail engine vs full
+decode and one resample per size.
+
+usage: bench-thumb.py [megapixels] [repeat] [directory]
+'''
+import io
+import sys
+import time
+import tempfile
+from PIL import Image
+
+import corpus
+from rephile.files import thumb
+
+
+def fulldecode(files, sizes=((128,128), (256,256), (512,512))):
+    'The pre-engine implementation, kept here for comparison'
+    ret = list()
+    for path in files:
+        one = dict()
+        full = Image.open(path)
+        for size in sizes:
+            if size[0] > full.size[0] or size[1] > full.size[1]:
+                break
+            img = full.copy()
+            img.thumbnail(size)
+            with io.BytesIO() as output:
+                img.save(output, format="PNG")
+                one[img.size] = output.getvalue()
+        ret.append(one)
+    return ret
+
+
+def timeit(meth, path, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        meth([path])
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main(mp=24, repeat=3, tdir=None):
+    mp = float(mp)
+    repeat = int(repeat)
+    width = int((mp * 1e6 * 4 / 3) ** 0.5)
+    size = (width, width * 3 // 4)
+    with tempfile.TemporaryDirectory(dir=tdir) as tmp:
+        plain = corpus.write_jpeg(f"{tmp}/plain.jpg", size, 1)
+        small = corpus.write_jpeg(f"{tmp}/small.jpg", size, 1,
+                                  preview=(160, 120))
+        big = corpus.write_jpeg(f"{tmp}/big.jpg", size, 1,
+                                preview=(512, 512))
+        print(f"{size[0]}x{size[1]} JPEG, best of {repeat}")
+        for name, meth, path in [
+                ("full decode", fulldecode, plain),
+                ("engine", thumb, plain),
+                ("engine, 160px preview", thumb, small),
+                ("engine, 512px preview", thumb, big)]:
+            dt = timeit(meth, path, repeat)
+            print(f"{name:24} {dt*1000:8.1f} ms/image")
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''
+Reproducible synthetic photos for tests and benchmarks.
+'''
+import io
+import os
+import math
+import random
+import shutil
+import struct
+from PIL import Image
+
+
+def photo(size, seed=0):
+    '''
+    Return an RGB image of size with smooth, photo-like content.
+
+    The same size and seed always give the same image.
+    '''
+    rng = random.Random(seed)
+    small = (max(2, size[0]//64), max(2, size[1]//64))
+    bands = [Image.frombytes("L", small, rng.randbytes(small[0]*small[1]))
+             .resize(size, Image.BICUBIC) for _ in range(3)]
+    return Image.merge("RGB", bands)
+
+
+def exif_preview(preview, quality=60):
+    '''
+    Return raw EXIF bytes with preview (an image) embedded as the IFD1
+    JPEG thumbnail, as a camera would write it.
+    '''
+    with io.BytesIO() as out:
+        preview.save(out, format="JPEG", quality=quality)
+        data = out.getvalue()
+    # TIFF header, IFD0 with one entry (Orientation), IFD1 with the
+    # JPEGInterchangeFormat offset and length, then the JPEG data.
+    ifd0 = 8
+    ifd1 = ifd0 + 2 + 12 + 4
+    start = ifd1 + 2 + 2*12 + 4
+    tiff = b"II*\x00" + struct.pack("<I", ifd0)
+    tiff += struct.pack("<H", 1)
+    tiff += struct.pack("<HHIHH", 0x0112, 3, 1, 1, 0)
+    tiff += struct.pack("<I", ifd1)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, start)
+    tiff += struct.pack("<HHII", 0x0202, 4, 1, len(data))
+    tiff += struct.pack("<I", 0)
+    return b"Exif\x00\x00" + tiff + data
+
+
+def exif_tags(seed=0):
+    '''
+    Return raw EXIF bytes with camera, time and exposure tags.
+    '''
+    rng = random.Random(seed)
+    exif = Image.Exif()
+    exif[0x010f] = rng.choice(["Canon", "NIKON CORPORATION", "FUJIFILM"])
+    exif[0x0110] = f"Model {rng.randrange(10)}"
+    when = f"20{rng.randrange(10, 24)}:{rng.randrange(1, 13):02d}:" \
+        f"{rng.randrange(1, 29):02d} {rng.randrange(24):02d}:" \
+        f"{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+    exif[0x0132] = when
+    sub = exif.get_ifd(0x8769)
+    sub[0x9003] = when                                  # DateTimeOriginal
+    sub[0x8827] = rng.choice([100, 200, 400, 800, 3200])  # ISO
+    sub[0x920a] = rng.choice([24.0, 35.0, 50.0, 85.0])    # FocalLength
+    return exif.tobytes()
+
+
+def write_jpeg(path, size, seed=0, preview=None, quality=90, tags=False):
+    '''
+    Write a synthetic JPEG photo of size to path.
+
+    If preview is a size, embed an EXIF preview of that size.  Else if
+    tags is True, embed EXIF tags.
+    '''
+    img = photo(size, seed)
+    kwds = dict()
+    if preview:
+        small = img.copy()
+        small.thumbnail(preview)
+        kwds["exif"] = exif_preview(small)
+    elif tags:
+        kwds["exif"] = exif_tags(seed)
+    img.save(path, format="JPEG", quality=quality, **kwds)
+    return path
+
+
+def write_corpus(base, count=100, megapixels=(1, 4), png=0.1, dups=0.1,
+                 skew=0.0, seed=0):
+    '''
+    Write count synthetic photos under directory base, return file names.
+
+    Sizes are drawn from the megapixels range with 4:3 aspect.  About
+    a fraction png are PNG and the rest are JPEG with EXIF tags.  A
+    fraction dups are byte copies of earlier files and a fraction skew
+    are four times the largest size.  Files are in subdirectories of
+    at most 100.  The same arguments always give the same corpus.
+    '''
+    rng = random.Random(seed)
+    files = list()
+    for ind in range(count):
+        sub = os.path.join(base, f"{ind // 100:03d}")
+        os.makedirs(sub, exist_ok=True)
+        if files and rng.random() < dups:
+            orig = rng.choice(files)
+            path = os.path.join(sub, f"dup{ind:05d}" + os.path.splitext(orig)[1])
+            shutil.copyfile(orig, path)
+            files.append(path)
+            continue
+        mp = rng.uniform(*megapixels)
+        if rng.random() < skew:
+            mp = 4 * megapixels[1]
+        width = int(math.sqrt(mp * 1e6 * 4 / 3))
+        size = (width, width * 3 // 4)
+        if rng.random() < png:
+            path = os.path.join(sub, f"img{ind:05d}.png")
+            photo(size, ind).save(path, format="PNG")
+        else:
+            path = os.path.join(sub, f"img{ind:05d}.jpg")
+            write_jpeg(path, size, ind, tags=True)
+        files.append(path)
+    return files
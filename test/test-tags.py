@@ -18,3 +18,60 @@ def test_add_new():
         assert tag.name == tag.description
 
     birth(r.session, tags[-1], tags[:-1])
+
+
+def test_closure():
+    '''
+    Transitive tag queries see the whole tag graph
+    '''
+    from rephile.dbtypes import Digest, TagClosure
+    from rephile.tags import reclose
+    r = Rephile("sqlite://")
+    r.tags("travel", "europe", "france", "paris", "cats", assure=True)
+    birth(r.session, "travel", "europe")
+    birth(r.session, "france", "paris")
+    birth(r.session, "europe", "france")
+    dig1 = Digest(id="abc")
+    dig2 = Digest(id="def")
+    r.session.add_all([dig1, dig2])
+    birth(r.session, "paris", dig1)
+    birth(r.session, ["cats", "europe"], dig2)
+
+    assert [d.id for d in r.tagged("travel")] == ["abc", "def"]
+    assert [d.id for d in r.tagged("travel", transitive=False)] == []
+    assert [d.id for d in r.tagged("cats")] == ["def"]
+    travel, = r.tags("travel")
+    paris, = r.tags("paris")
+    assert sorted(t.name for t in travel.descendants()) == \
+        ["europe", "france", "paris"]
+    assert sorted(t.name for t in paris.ancestors()) == \
+        ["europe", "france", "travel"]
+
+    pairs = lambda: sorted((c.ancestor_id, c.descendant_id)
+                           for c in r.session.query(TagClosure))
+    before = pairs()
+    reclose(r.session)
+    assert pairs() == before
+
+
+def test_bulk_tag(tmp_path, monkeypatch):
+    '''
+    Tag and untag files in bulk
+    '''
+    import rephile.attrs
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    files = list()
+    for ind in range(5):
+        fname = tmp_path / f"file{ind}.txt"
+        fname.write_text(f"file {ind}\n" * (ind % 3))
+        files.append(str(fname))
+    r = Rephile("sqlite://")
+    r.tag(files, "a", "b")
+    r.tag(files[:2], "b", "c")
+    # file0 and file3 are both empty, so share a digest
+    assert r.tagnames(files) == [["a", "b", "c"], ["a", "b", "c"],
+                                 ["a", "b"], ["a", "b", "c"], ["a", "b"]]
+    r.untag(files[1:], "a", "nope")
+    assert r.tagnames(files) == [["b", "c"], ["b", "c"], ["b"],
+                                 ["b", "c"], ["b"]]
+    assert len(r.tagged("c")) == 2
@@ -0,0 +1,62 @@
+#!/usr/bin/env pytest
+
+import os
+import subprocess
+import rephile.attrs
+from rephile.main import Rephile
+from rephile.dbtypes import Path, Collection, Annex
+from rephile.files import hashsize_one
+
+# Not the hash of the content, to show the content is not read.
+sha = "ab" * 32
+
+
+def make_annex(top):
+    subprocess.run(["git", "init", "-q", str(top)], check=True)
+    subprocess.run(["git", "-C", str(top), "config", "annex.uuid", "u-1"],
+                   check=True)
+    key = f"SHA256E-s5--{sha}.jpg"
+    obj = top / ".git" / "annex" / "objects" / "Xx" / "Yy" / key
+    obj.parent.mkdir(parents=True)
+    obj.write_text("hello")
+    os.symlink(os.path.relpath(obj, top), top / "present.jpg")
+    os.symlink(os.path.relpath(obj, top).replace("Xx", "Zz"),
+               top / "absent.jpg")
+    (top / "unlocked.jpg").write_text(f"/annex/objects/{key}\n")
+    (top / "plain.txt").write_text("/annex/objects/not a key\n")
+
+
+def test_annex_keys(tmp_path, monkeypatch):
+    '''
+    Annexed files are digested from their keys
+    '''
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    make_annex(tmp_path)
+    names = ["present.jpg", "absent.jpg", "unlocked.jpg", "plain.txt"]
+    files = [str(tmp_path / n) for n in names]
+    assert [hashsize_one(f) for f in files[:3]] == [(sha, 5)] * 3
+    assert hashsize_one(files[3])[0] != sha
+
+    r = Rephile("sqlite://")
+    digs = r.digest(files)
+    assert [d.id for d in digs[:3]] == [sha] * 3
+    assert (digs[0].size, digs[0].mime) == (5, "text/plain")
+
+    coll, = r.session.query(Collection).all()
+    assert coll.base == str(tmp_path)
+    assert r.session.query(Annex).one().uuid == "u-1"
+    assert all(p.collection_id == coll.id
+               for p in r.session.query(Path))
+    # absent content is digested again without error
+    assert [d.id for d in r.digest(files[:2])] == [sha] * 2
+
+
+def test_pointer_only():
+    '''
+    Only data holding nothing but a key line is a pointer file
+    '''
+    from rephile.annex import pointer
+    key = f"/annex/objects/SHA256E-s5--{sha}.jpg".encode()
+    assert pointer(key) == (sha, 5)
+    assert pointer(memoryview(key + b"\n")) == (sha, 5)
+    assert pointer(key + b"\nmore content\n") is None
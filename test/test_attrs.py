@@ -0,0 +1,75 @@
+#!/usr/bin/env pytest
+
+from datetime import datetime
+from rephile.main import Rephile
+from rephile.dbtypes import Digest, Attribute, AttrType
+from rephile.attrs import typed, parse
+
+
+def test_typed():
+    assert typed(3200)["real"] == 3200.0
+    assert typed(2.8)["atype"] == AttrType.rational
+    got = typed("2019:06:01 12:34:56+02:00")
+    assert got["time"] == datetime(2019, 6, 1, 12, 34, 56)
+    assert got["atype"].cast(got["text"]) == "2019:06:01 12:34:56+02:00"
+    assert typed("0000:00:00 00:00:00")["atype"] == AttrType.string
+    assert typed("Canon")["atype"] == AttrType.string
+
+
+def test_parse():
+    assert parse("ISO>3200") == ("ISO", ">", 3200)
+    assert parse("FNumber <= 2.8") == ("FNumber", "<=", 2.8)
+    assert parse("DateTimeOriginal>=2019-01-01") == \
+        ("DateTimeOriginal", ">=", datetime(2019, 1, 1))
+    assert parse("Model=Canon EOS R5") == ("Model", "=", "Canon EOS R5")
+    assert parse("Model~%EOS%") == ("Model", "~", "%EOS%")
+    assert parse("SerialNumber=007") == ("SerialNumber", "=", "007")
+
+
+def test_find():
+    r = Rephile("sqlite://")
+    md = dict(
+        a=dict(ISO=6400, Model="X", DateTimeOriginal="2019:03:01 10:00:00"),
+        b=dict(ISO=100, Model="X", DateTimeOriginal="2019:07:01 10:00:00"),
+        c=dict(ISO=6400, Model="Y", DateTimeOriginal="2019:08:01 10:00:00"),
+        d=dict(ISO=6400, Model="X", DateTimeOriginal="2020:01:02 10:00:00"),
+    )
+    for sha, attrs in md.items():
+        r.session.add(Digest(id=sha))
+        r.session.add_all([Attribute(name=k, digest_id=sha, **typed(v))
+                           for k, v in attrs.items()])
+    r.session.commit()
+
+    got = r.find("ISO>3200", "Model=X", "DateTimeOriginal>=2019-01-01",
+                 ("DateTimeOriginal", "<", datetime(2020, 1, 1)))
+    assert [d.id for d in got] == ["a"]
+    assert sorted(d.id for d in r.find("Model~%")) == list("abcd")
+    assert r.find("ISO>100000") == []
+    dig = r.session.get(Digest, "a")
+    assert dig.attrmap["DateTimeOriginal"] == "2019:03:01 10:00:00"
+    assert dig.attrmap["ISO"] == 6400
+
+
+def test_find_equal():
+    '''
+    Equality matches the text as well as any typed value
+    '''
+    r = Rephile("sqlite://")
+    md = dict(
+        a=dict(Model="350", SerialNumber="007", FNumber=2.8, ISO=100),
+        b=dict(Model="351", SerialNumber="7", FNumber=4.0, ISO=200),
+    )
+    for sha, attrs in md.items():
+        r.session.add(Digest(id=sha))
+        r.session.add_all([Attribute(name=k, digest_id=sha, **typed(v))
+                           for k, v in attrs.items()])
+    r.session.commit()
+
+    ids = lambda *preds: sorted(d.id for d in r.find(*preds))
+    assert ids("Model=350") == ["a"]
+    assert ids("SerialNumber=007") == ["a"]
+    assert ids("FNumber=2.80") == ["a"]
+    assert ids(("ISO", "==", 200)) == ["b"]
+    assert ids("Model!=350") == ["b"]
+    assert ids("FNumber!=4") == ["a"]
+    assert ids("ISO>150") == ["b"]
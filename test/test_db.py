@@ -0,0 +1,127 @@
+#!/usr/bin/env pytest
+
+from rephile.main import Rephile
+from rephile.db import insert, inchunks
+from rephile.dbtypes import Digest, Tag
+
+
+def test_insert():
+    r = Rephile("sqlite://")
+    ses = r.session
+    insert(ses, Digest, [Digest(id="a", size=1), dict(id="b", mime="x")])
+    insert(ses, Digest, [dict(id="a", size=2), dict(id="c", size=3)])
+    got = {d.id: (d.size, d.mime) for d in ses.query(Digest)}
+    assert got == dict(a=(1, None), b=(None, "x"), c=(3, None))
+
+    insert(ses, Digest, [dict(id="a", size=4, mime="y")], update=["size"])
+    ses.expire_all()
+    assert (ses.get(Digest, "a").size, ses.get(Digest, "a").mime) == (4, None)
+
+    insert(ses, Tag, [dict(name="t", description="one")])
+    insert(ses, Tag, [dict(name="t", description="two")],
+           update=True, index=["name"])
+    assert [t.description for t in ses.query(Tag)] == ["two"]
+
+
+def test_inchunks():
+    r = Rephile("sqlite://")
+    insert(r.session, Digest, [dict(id=str(n)) for n in range(20)])
+    keys = [str(n) for n in range(0, 40, 3)] * 2
+    got = inchunks(r.session.query(Digest), Digest.id, keys, size=4)
+    assert sorted(int(d.id) for d in got) == list(range(0, 20, 3))
+
+
+# Part of the schema of caches made before the stat signature, typed
+# attributes, tag closure, perceptual hash and uploads.
+old_schema = [
+    "CREATE TABLE digest (id VARCHAR NOT NULL, size INTEGER, "
+    "mime VARCHAR, magic VARCHAR, PRIMARY KEY (id))",
+    "CREATE TABLE path (id VARCHAR NOT NULL, real VARCHAR, mode INTEGER, "
+    "uid INTEGER, gid INTEGER, atime DATETIME, mtime DATETIME, "
+    "ctime DATETIME, digest_id INTEGER, collection_id INTEGER, "
+    "PRIMARY KEY (id))",
+    "CREATE TABLE attribute (id INTEGER NOT NULL, name VARCHAR, "
+    "text VARCHAR, atype VARCHAR(8), digest_id INTEGER NOT NULL, "
+    "PRIMARY KEY (id), CONSTRAINT _name_uc UNIQUE (digest_id, name))",
+    "CREATE TABLE tag (id INTEGER NOT NULL, name VARCHAR, "
+    "description VARCHAR, PRIMARY KEY (id), "
+    "CONSTRAINT _name_uc UNIQUE (name))",
+    "CREATE TABLE tagtagedge (id INTEGER NOT NULL, head_id INTEGER NOT NULL, "
+    "tail_id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (tail_id, head_id))",
+    "CREATE TABLE digesttagedge (id INTEGER NOT NULL, "
+    "tag_id INTEGER NOT NULL, digest_id INTEGER NOT NULL, "
+    "PRIMARY KEY (id), UNIQUE (digest_id, tag_id))",
+]
+
+
+def old_cache(path, *rows):
+    'Make an old cache file holding rows (SQL inserts), return its name'
+    import sqlite3
+    fname = str(path / "old.db")
+    con = sqlite3.connect(fname)
+    for stmt in old_schema + list(rows):
+        con.execute(stmt)
+    con.commit()
+    con.close()
+    return fname
+
+
+def test_upgrade(tmp_path, monkeypatch):
+    '''
+    An old cache is upgraded when opened and may then be used
+    '''
+    import rephile.attrs
+    from sqlalchemy import inspect
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    fname = old_cache(tmp_path)
+    data = tmp_path / "data.txt"
+    data.write_text("hello")
+    with Rephile(fname) as rep:
+        dig = rep.digest([str(data)])[0]
+        assert dig.size == 5
+        cols = {c["name"] for c in inspect(rep.session.get_bind())
+                .get_columns("path")}
+        assert {"size", "inode"} <= cols
+        insp = inspect(rep.session.get_bind())
+        assert "phash" in {c["name"] for c in insp.get_columns("digest")}
+        assert {"upload", "tagclosure"} <= set(insp.get_table_names())
+    with Rephile(fname) as rep:
+        assert rep.digest([str(data)])[0].id == dig.id
+
+
+def test_upgrade_attrs(tmp_path):
+    '''
+    Typed values of attributes in an old cache are filled in and found
+    '''
+    from rephile.dbtypes import Attribute, AttrType
+    fname = old_cache(
+        tmp_path,
+        "INSERT INTO digest (id, size) VALUES ('a', 1), ('b', 2)",
+        "INSERT INTO attribute (name, text, atype, digest_id) VALUES "
+        "('ISO', '800', 'integer', 'a'), ('ISO', '3200', 'integer', 'b'), "
+        "('FNumber', '2.8', 'rational', 'a'), "
+        "('DateTimeOriginal', '2020:01:02 03:04:05', 'string', 'a'), "
+        "('Model', 'X100', 'string', 'a')")
+    with Rephile(fname) as rep:
+        ses = rep.session
+        assert [d.id for d in rep.find("ISO>1000")] == ["b"]
+        assert [d.id for d in rep.find("FNumber<4")] == ["a"]
+        assert [d.id for d in rep.find("DateTimeOriginal>2019:12:31")] == ["a"]
+        assert [d.id for d in rep.find("Model=X100")] == ["a"]
+        got = ses.query(Attribute).filter_by(name="DateTimeOriginal").one()
+        assert got.atype == AttrType.datetime
+
+
+def test_upgrade_tags(tmp_path):
+    '''
+    The tag closure of an old cache is made when it is upgraded
+    '''
+    fname = old_cache(
+        tmp_path,
+        "INSERT INTO digest (id) VALUES ('a')",
+        "INSERT INTO tag (id, name) VALUES (1, 'top'), (2, 'mid'), (3, 'low')",
+        "INSERT INTO tagtagedge (tail_id, head_id) VALUES (2, 1), (3, 2)",
+        "INSERT INTO digesttagedge (tag_id, digest_id) VALUES (3, 'a')")
+    with Rephile(fname) as rep:
+        assert [d.id for d in rep.tagged("top")] == ["a"]
+        assert [d.id for d in rep.tagged("top", False)] == []
@@ -0,0 +1,47 @@
+#!/usr/bin/env pytest
+
+import os
+from rephile.main import Rephile
+from rephile.dbtypes import Digest
+import rephile.files as rfiles
+import rephile.paths as rpaths
+
+
+def test_tiers(tmp_path, monkeypatch):
+    '''
+    Only files alike in size and head and tail are hashed in full
+    '''
+    monkeypatch.setattr(rfiles, "partsize", 4)
+    body = "x" * 100
+    contents = dict(
+        a1=body, a2=body, a3=body,        # duplicates
+        b="y" + body[1:],                 # same size, differs at head
+        c=body[:50] + "y" + body[51:],    # same size, differs in middle
+        d="short",                        # lone size
+        e1="", e2="")
+    for name, text in contents.items():
+        (tmp_path / name).write_text(text)
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "c2").write_text(contents["c"])
+
+    hashed = list()
+    orig = rfiles.hashsize_one
+    monkeypatch.setattr(rfiles, "hashsize_one",
+                        lambda f, *a: hashed.append(os.path.basename(f)) or orig(f, *a))
+
+    r = Rephile("sqlite://")
+    # a1 is cached and so is not hashed again
+    sha = orig(str(tmp_path / "a1"))[0]
+    r.session.add_all([Digest(id=sha),
+                       rpaths.make_one(str(tmp_path / "a1"), sha)])
+    r.session.commit()
+
+    got = r.dupes([str(tmp_path)])
+    assert [(s, [os.path.relpath(p, tmp_path) for p in ps])
+            for _, s, ps in got] == [
+                (100, ["a1", "a2", "a3"]),
+                (100, ["c", "sub/c2"]),
+                (0, ["e1", "e2"])]
+    assert got[0][0] == sha
+    assert sorted(hashed) == ["a2", "a3", "c", "c2", "e1", "e2"]
@@ -0,0 +1,176 @@
+#!/usr/bin/env pytest
+
+import hashlib
+import rephile.files as rfiles
+
+
+def test_hashsize_streams(tmp_path, monkeypatch):
+    '''
+    Hashing in small blocks gives the whole-file hash and size
+    '''
+    monkeypatch.setattr(rfiles, "blocksize", 1000)
+    data = bytes(range(256)) * 50
+    path = tmp_path / "data.bin"
+    path.write_bytes(data)
+
+    sha, size = rfiles.hashsize_one(str(path))
+    assert size == len(data)
+    assert sha == hashlib.sha256(data).hexdigest()
+    assert rfiles.hash_one(str(path)) == sha
+
+
+def test_blocks_threads(tmp_path, monkeypatch):
+    '''
+    Files hashed at once in threads and interleaved do not share blocks
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(rfiles, "blocksize", 1000)
+    files = list()
+    for ind in range(8):
+        path = tmp_path / f"data{ind}.bin"
+        path.write_bytes(bytes([ind]) * 50000)
+        files.append(str(path))
+    want = [hashlib.sha256(open(f, 'rb').read()).hexdigest() for f in files]
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(rfiles.hash_one, files * 4)) == want * 4
+
+    gens = [rfiles.blocks(files[1]), rfiles.blocks(files[2])]
+    one, two = [next(g) for g in gens]
+    assert (bytes(one), bytes(two)) == (bytes([1]) * 1000, bytes([2]) * 1000)
+
+
+def test_hashsize_empty(tmp_path):
+    path = tmp_path / "empty"
+    path.write_bytes(b"")
+    assert rfiles.hashsize(str(path)) == [(hashlib.sha256().hexdigest(), 0)]
+
+
+def test_sniff_one_open(tmp_path, monkeypatch):
+    '''
+    Hash and content types come from a single open of the file
+    '''
+    import corpus
+    jpeg = corpus.write_jpeg(str(tmp_path / "photo.jpg"), (640, 480))
+    text = tmp_path / "note.txt"
+    text.write_text("hello world\n")
+    opened = list()
+    monkeypatch.setattr(rfiles, "open", lambda *a, **k:
+                        opened.append(a[0]) or open(*a, **k), raising=False)
+    got = rfiles.sniff([jpeg, str(text)])
+    assert opened == [jpeg, str(text)]
+    for path, one in zip((jpeg, str(text)), got):
+        assert one[:2] == rfiles.hashsize_one(path)
+        assert one[2:] == (rfiles.mime_one(path), rfiles.magic_one(path))
+    assert got[0][2] == "image/jpeg"
+    assert rfiles.magics() is rfiles.magics()
+
+
+def test_xattr(tmp_path, monkeypatch):
+    '''
+    Hashes cached in extended attributes are used until the file changes
+    '''
+    import os, shutil, pytest
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"hello")
+    fname = str(path)
+    try:
+        os.setxattr(fname, "user.rephile.test", b"")
+    except OSError:
+        pytest.skip("no user extended attributes here")
+
+    want = (hashlib.sha256(b"hello").hexdigest(), 5)
+    assert rfiles.xattr_get(fname) is None
+    assert rfiles.hashsize_one(fname, True) == want
+    assert rfiles.xattr_get(fname) == want
+
+    # A hit reads no file content.
+    monkeypatch.setattr(rfiles, "blocks", None)
+    assert rfiles.hashsize_one(fname, True) == want
+    monkeypatch.undo()
+
+    # Kept by a copy keeping attributes and times.
+    copy = str(tmp_path / "copy.bin")
+    shutil.copy2(fname, copy)
+    assert rfiles.xattr_get(copy) == want
+
+    # Ignored if not a hash.
+    s = os.stat(copy)
+    for bad in ("abc", "g" * 64, want[0][:-1] + " x"):
+        os.setxattr(copy, rfiles.xattr_name,
+                    f"{bad} {s.st_size} {s.st_mtime_ns}".encode())
+        assert rfiles.xattr_get(copy) is None
+        assert rfiles.hashsize_one(copy, True) == want
+
+    # Invalidated by a change of content.
+    path.write_bytes(b"HELLO")
+    assert rfiles.xattr_get(fname) is None
+    want = (hashlib.sha256(b"HELLO").hexdigest(), 5)
+    assert rfiles.hashsize_one(fname, True) == want
+    assert rfiles.xattr_get(fname) == want
+
+
+def test_thumb_preview(tmp_path):
+    '''
+    A big enough EXIF preview is used instead of the image
+    '''
+    from PIL import Image
+    import corpus
+    red = Image.new("RGB", (320, 240), (255, 0, 0))
+    path = str(tmp_path / "p.jpg")
+    corpus.photo((1200, 900)).save(path, exif=corpus.exif_preview(red))
+
+    imgs = rfiles.thumbnails(path, ((128, 128), (256, 256)))
+    assert [i.size for i in imgs] == [(128, 96), (256, 192)]
+    for img in imgs:
+        r, g, b = img.convert("RGB").getpixel((10, 10))
+        assert r > 240 and g < 16 and b < 16
+
+    imgs = rfiles.thumbnails(path, ((128, 128), (512, 512)))
+    assert [i.size for i in imgs] == [(128, 96), (512, 384)]
+    assert imgs[-1].convert("RGB").getpixel((10, 10)) != (255, 0, 0)
+
+
+def test_preview_aspect(tmp_path):
+    '''
+    An EXIF preview of another aspect ratio than the image is not used
+    '''
+    from PIL import Image
+    import corpus
+    path = str(tmp_path / "p.jpg")
+    for size, want in [((640, 427), None), ((640, 480), (640, 480))]:
+        red = Image.new("RGB", size, (255, 0, 0))
+        Image.new("L", (8000, 6000), 128).save(
+            path, exif=corpus.exif_preview(red))
+        with Image.open(path) as img:
+            pimg = rfiles.preview(img, (256, 256))
+            assert (pimg and pimg.size) == want
+    imgs = rfiles.thumbnails(path, ((128, 128), (256, 256)))
+    assert [i.size for i in imgs] == [(128, 96), (256, 192)]
+
+
+def test_thumb_not_image(tmp_path):
+    path = tmp_path / "text.txt"
+    path.write_text("not an image")
+    assert rfiles.thumb(str(path)) == [dict()]
+
+
+def test_walk(tmp_path):
+    for name in ["a.jpg", "b.txt", "sub/c.jpg", "sub/deep/d.jpg",
+                 "skip/e.jpg"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    (tmp_path / "link").symlink_to(tmp_path / "sub")
+    root = str(tmp_path)
+
+    got = list(rfiles.walk([root], include=["*.jpg"], exclude=["skip"]))
+    assert got == [f"{root}/{n}" for n in
+                   ["a.jpg", "sub/c.jpg", "sub/deep/d.jpg"]]
+    assert f"{root}/link" not in rfiles.walk([root])
+    assert list(rfiles.walk([f"{root}/b.txt", f"{root}/sub/deep"])) == \
+        [f"{root}/b.txt", f"{root}/sub/deep/d.jpg"]
+
+
+def test_batched():
+    from rephile.util import batched
+    assert list(batched(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,68 @@
+#!/usr/bin/env pytest
+
+import os
+from rephile.jobs import Pool, pool, pmapgroup
+
+
+def square(x):
+    return x*x
+
+def squares(xs):
+    return [x*x for x in xs]
+
+def pids(xs):
+    return [os.getpid() for x in xs]
+
+
+def test_mapgroup_order():
+    lst = list(range(100))
+    want = [x*x for x in lst]
+    for nproc in (1, 3):
+        with Pool(nproc) as p:
+            assert p.mapgroup(squares, lst) == want
+            assert p.map(square, lst) == want
+            assert list(p.imap(square, lst)) == want
+            assert sorted(p.imap_unordered(square, lst)) == want
+            assert p.mapgroup(squares, []) == []
+    assert pmapgroup(squares, lst, 2) == want
+
+
+def test_reuse():
+    '''
+    Workers outlive one call and are stopped by close()
+    '''
+    p = Pool(2)
+    first = set(p.mapgroup(pids, range(10)))
+    workers = {w.pid for w in p.pool._pool}
+    second = set(p.mapgroup(pids, range(10)))
+    assert os.getpid() not in first
+    assert first | second <= workers
+    assert workers == {w.pid for w in p.pool._pool}
+    p.close()
+    assert p._pool is None
+    assert pool(p) is p
+    assert pool(2) is pool(2)
+
+
+def test_inline():
+    assert Pool(1).mapgroup(pids, range(3)) == [os.getpid()]*3
+
+
+def test_weighted():
+    '''
+    Weighted groups still give results in input order
+    '''
+    lst = list(range(50))
+    weights = [1000 if x % 17 == 0 else 1 for x in lst]
+    with Pool(3) as p:
+        assert p.mapgroup(squares, lst, weights) == [x*x for x in lst]
+
+
+def test_partition():
+    from rephile.util import partition
+    weights = [100, 1, 1, 1, 50, 50, 1, 1]
+    parts = partition(weights, 3)
+    assert sorted(sum(parts, [])) == list(range(len(weights)))
+    assert parts[0] == [0]
+    assert sorted(sum(weights[i] for i in p) for p in parts) == [52, 53, 100]
+    assert len(partition([1, 1], 5)) == 2
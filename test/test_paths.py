@@ -0,0 +1,89 @@
+#!/usr/bin/env pytest
+
+import os
+from rephile.main import Rephile
+import rephile.paths as rpaths
+
+
+def test_known_signature(tmp_path):
+    '''
+    Only files with unchanged stat signature are known
+    '''
+    r = Rephile("sqlite://")
+    fnames = list()
+    for name in "abc":
+        path = tmp_path / name
+        path.write_text(name)
+        fnames.append(str(path))
+    r.session.add_all(rpaths.make_some([(f, "sha-"+f[-1]) for f in fnames]))
+    r.session.commit()
+
+    assert rpaths.known(r.session, fnames) == \
+        {f: "sha-"+f[-1] for f in fnames}
+
+    st = os.stat(fnames[0])
+    os.utime(fnames[0], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    with open(fnames[1], "a") as fp:
+        fp.write("more")
+    os.remove(fnames[2])
+
+    assert rpaths.known(r.session, fnames) == {}
+
+
+def test_load_queries(tmp_path):
+    '''
+    Loading and walking many paths takes a fixed number of queries
+    '''
+    from sqlalchemy import event
+    from rephile.dbtypes import Digest, Attribute, Thumb
+    from rephile.attrs import typed
+
+    r = Rephile("sqlite://")
+    fnames = list()
+    for ind in range(40):
+        path = tmp_path / f"file{ind}"
+        path.write_text(str(ind))
+        fnames.append(str(path))
+        sha = f"sha{ind%20}"
+        if ind < 20:
+            r.session.add(Digest(id=sha))
+            r.session.add(Attribute(name="Model", digest_id=sha,
+                                    **typed("X")))
+            r.session.add(Thumb(width=128, height=96, digest_id=sha))
+        r.session.add(rpaths.make_one(str(path), sha))
+    r.session.commit()
+
+    queries = list()
+    event.listen(r.session.get_bind(), "before_cursor_execute",
+                 lambda *args: queries.append(args[2]))
+    paths = rpaths.load(r.session, fnames, thumbs=True)
+    for pobj in paths:
+        dat = rpaths.asdict(pobj)
+        dig = dat["digest"]
+        assert dig.attrmap["Model"] == "X"
+        assert dig.thumb().width == 128
+        assert len(dig.paths) == 2
+    assert [p.id for p in paths] == fnames
+    assert len(queries) <= 5
+
+
+def test_many_keys(tmp_path, monkeypatch):
+    '''
+    Membership lookups work beyond SQLite's bound parameter limit
+    '''
+    import rephile.db as rdb
+    r = Rephile("sqlite://")
+    fnames = list()
+    for ind in range(7):
+        path = tmp_path / f"file{ind}"
+        path.write_text(str(ind))
+        fnames.append(str(path))
+    r.session.add_all(rpaths.make_some([(f, "sha") for f in fnames]))
+    r.session.commit()
+
+    many = [f"/no/such/file{ind}" for ind in range(40000)] + fnames
+    assert len(rpaths.known(r.session, many)) == len(fnames)
+
+    monkeypatch.setattr(rdb, "maxvars", 3)
+    got = rpaths.load(r.session, fnames[::-1])
+    assert [p.id for p in got] == fnames[::-1]
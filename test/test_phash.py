@@ -0,0 +1,77 @@
+#!/usr/bin/env pytest
+
+import random
+import corpus
+from rephile.main import Rephile
+from rephile.files import dhash_one
+from rephile.phash import Index, signed, unsigned
+import rephile.attrs
+import rephile.phash
+
+
+def test_dhash_copies(tmp_path):
+    '''
+    Resized and re-encoded copies hash near, other photos do not
+    '''
+    orig = corpus.write_jpeg(str(tmp_path / "orig.jpg"), (1600, 1200))
+    small = corpus.photo((1600, 1200))
+    small.thumbnail((400, 400))
+    small.save(tmp_path / "small.png")
+    other = corpus.write_jpeg(str(tmp_path / "other.jpg"), (1600, 1200), 7)
+    h = dhash_one(orig)
+    dist = lambda p: bin(h ^ dhash_one(str(p))).count("1")
+    assert dist(tmp_path / "small.png") <= 4
+    assert dist(other) > 16
+    assert dhash_one(str(tmp_path)) is None
+
+
+def test_index():
+    '''
+    NumPy and plain Python find the same near hashes
+    '''
+    rng = random.Random(1)
+    hashes = [signed(rng.getrandbits(64)) for _ in range(1000)]
+    hashes[10] = signed(unsigned(hashes[0]) ^ 0b1011)
+    ind = Index(range(1000), hashes)
+    got = ind.near(hashes[0], 3)
+    assert got == [(0, 0), (3, 10)]
+    ind.numpy = None
+    ind.hashes = [unsigned(h) for h in hashes]
+    assert ind.near(hashes[0], 3) == got
+
+
+def test_similar(tmp_path, monkeypatch):
+    '''
+    Ingested images are found by similarity
+    '''
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    files = [corpus.write_jpeg(str(tmp_path / "a.jpg"), (800, 600)),
+             corpus.write_jpeg(str(tmp_path / "b.jpg"), (800, 600), quality=50),
+             corpus.write_jpeg(str(tmp_path / "c.jpg"), (800, 600), 3)]
+    r = Rephile("sqlite://")
+    got = r.similar(files)
+    assert [[d.paths[0].id for _, d in near] for near in got] == \
+        [files[:2], files[:2], files[2:]]
+
+
+def test_fill(tmp_path, monkeypatch):
+    '''
+    Images lacking a hash are hashed only when asked for
+    '''
+    from sqlalchemy import update
+    from rephile.dbtypes import Digest
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    files = [corpus.write_jpeg(str(tmp_path / "a.jpg"), (800, 600)),
+             corpus.write_jpeg(str(tmp_path / "b.jpg"), (800, 600), 3)]
+    r = Rephile("sqlite://")
+    r.digest(files)
+    r.session.execute(update(Digest).values(phash=None))
+    r.session.commit()
+    tried = list()
+    monkeypatch.setattr(rephile.phash, "dhash_one",
+                        lambda p: tried.append(p) or dhash_one(p))
+    assert r.similar(files[:1]) == [[]]
+    assert tried == []
+    got = r.similar(files[:1], fill=True)
+    assert [d.paths[0].id for _, d in got[0]] == files[:1]
+    assert sorted(tried) == files
@@ -0,0 +1,47 @@
+#!/usr/bin/env pytest
+
+import pytest
+from rephile import profile
+from rephile.jobs import Pool
+import rephile.files as rfiles
+
+
+@pytest.fixture
+def prof():
+    profile.reset()
+    yield profile
+    profile.enable(False)
+    profile.reset()
+
+
+def test_off(tmp_path, prof):
+    '''
+    Nothing is recorded unless enabled
+    '''
+    path = tmp_path / "data"
+    path.write_bytes(b"x" * 1000)
+    with prof.stage("nothing") as got:
+        rfiles.hashsize([str(path)])
+    assert got is None
+    assert prof.report()["stages"] == {}
+    assert prof.report()["counters"] == {}
+
+
+def test_workers(tmp_path, prof):
+    '''
+    Stages and counters from workers are collected
+    '''
+    files = list()
+    for ind in range(4):
+        path = tmp_path / f"data{ind}"
+        path.write_bytes(b"x" * 1000 * (ind + 1))
+        files.append(str(path))
+    prof.enable()
+    with Pool(2) as pool:
+        pool.mapgroup(rfiles.hashsize, files, [1, 2, 3, 4])
+        pool.mapgroup(rfiles.hashsize, files)
+    rep = prof.report()
+    assert rep["counters"]["bytes read"] == 2 * 10000
+    assert rep["stages"]["files.hash"]["calls"] >= 2
+    assert rep["stages"]["worker:hashsize"]["calls"] >= 2
+    assert 0 < rep["utilisation"] <= 1
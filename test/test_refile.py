@@ -0,0 +1,55 @@
+#!/usr/bin/env pytest
+
+import os
+import pytest
+from rephile.main import Rephile
+import rephile.attrs
+
+
+@pytest.fixture
+def rep(monkeypatch):
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    return Rephile("sqlite://")
+
+
+def make_files(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    files = list()
+    for ind, text in enumerate(["a", "b", "a", "c"]):
+        fname = src / f"file{ind}.txt"
+        fname.write_text(text)
+        files.append(str(fname))
+    return files
+
+
+def test_make_copy(tmp_path, rep):
+    '''
+    Copies are planned in full, duplicates are linked, targets kept
+    '''
+    files = make_files(tmp_path)
+    out = str(tmp_path / "out")
+    tgts = [out + f for f in files]
+    os.makedirs(os.path.dirname(tgts[3]))
+    with open(tgts[3], "w") as fp:
+        fp.write("keep")
+    fmt = out + "/{id}"
+    steps = rep.make(files, fmt)
+    assert [s.method for s in steps] == ["copy"] * 3 + ["exists"]
+    assert [s.tgt for s in steps] == tgts
+    assert steps[2].dup == tgts[0]
+    assert os.stat(tgts[0]).st_ino == os.stat(tgts[2]).st_ino
+    assert os.stat(tgts[0]).st_ino != os.stat(tgts[1]).st_ino
+    assert [open(t).read() for t in tgts] == ["a", "b", "a", "keep"]
+    assert [s.method for s in rep.make(files, fmt)] == ["exists"] * 4
+
+
+def test_make_collide(tmp_path, rep):
+    '''
+    Different content to one target is refused before doing anything
+    '''
+    files = make_files(tmp_path)
+    with pytest.raises(ValueError):
+        rep.make(files, str(tmp_path / "out" / "one.txt"), "move")
+    assert all(os.path.exists(f) for f in files)
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,37 @@
+#!/usr/bin/env pytest
+
+import os
+import sys
+import subprocess
+
+
+def test_light_imports(tmp_path):
+    '''
+    Commands not needing the cache, images or libmagic do not import them
+    '''
+    path = tmp_path / "data"
+    path.write_text("hello")
+    code = f"""
+import sys
+from click.testing import CliRunner
+from rephile.__main__ import cli
+got = CliRunner().invoke(cli, ["hashsize", {str(path)!r}])
+assert got.exit_code == 0, got.output
+heavy = [m for m in ("sqlalchemy", "PIL", "magic", "jinja2") if m in sys.modules]
+assert not heavy, heavy
+"""
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=top)
+
+
+def test_digest_imports():
+    '''
+    Digesting modules import PIL only when making images
+    '''
+    code = """
+import sys
+import rephile.digest, rephile.thumbs, rephile.phash
+assert "PIL" not in sys.modules
+"""
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=top)
@@ -0,0 +1,31 @@
+#!/usr/bin/env pytest
+
+import os
+import corpus
+from rephile.main import Rephile
+from rephile.dbtypes import Digest, Thumb
+import rephile.paths as rpaths
+
+
+def test_lazy_store(tmp_path):
+    '''
+    Thumbs are made in the store when first asked for
+    '''
+    photo = corpus.write_jpeg(str(tmp_path / "photo.jpg"), (800, 600))
+    store = tmp_path / "thumbs"
+    r = Rephile("sqlite://", thumbs=str(store))
+    dig = Digest(id="abc123", size=os.stat(photo).st_size)
+    r.session.add_all([dig, rpaths.make_one(photo, dig.id)])
+    r.session.commit()
+    assert not store.exists()
+
+    th = dig.thumb("large")
+    assert th.fdsize == "large"
+    assert (th.width, th.height) == (256, 192)
+    assert th.file == str(store / "large" / "abc123.jpg")
+    assert th.href() == "file://" + th.file
+    assert th.htmldata().startswith("data:image/jpeg;base64,")
+    assert dig.thumb("large") is th
+    assert dig.thumb("xx-large") is None
+    assert dig.thumb("xxx-large") is None
+    assert r.session.query(Thumb).count() == 0
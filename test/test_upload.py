@@ -0,0 +1,125 @@
+#!/usr/bin/env pytest
+
+import os
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from rephile.main import Rephile
+import rephile.attrs
+import rephile.ohecksoh
+import rephile.upload
+
+
+class Stand(BaseHTTPRequestHandler):
+    '''
+    A stand-in 0x0.st failing its first requests with server.fail status
+    '''
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.posts.append(body)
+        if len(self.server.posts) <= len(self.server.fail):
+            self.send_response(self.server.fail[len(self.server.posts) - 1])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        text = f"{self.server.url}{len(self.server.posts)}.txt\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    srv = HTTPServer(("127.0.0.1", 0), Stand)
+    srv.posts = list()
+    srv.fail = [429]
+    srv.url = f"http://127.0.0.1:{srv.server_port}/"
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(rephile.ohecksoh, "url", srv.url)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_upload(tmp_path, server, monkeypatch):
+    '''
+    Content is uploaded once, with retry, and its URL kept per digest
+    '''
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    http = rephile.upload.http
+    monkeypatch.setattr(rephile.upload, "http",
+                        lambda nconn: http(backoff=0, nconn=nconn))
+    files = list()
+    for ind, text in enumerate(["a", "b", "a"]):
+        fname = tmp_path / f"file{ind}.txt"
+        fname.write_text(text)
+        files.append(str(fname))
+
+    with Rephile("sqlite://") as rep:
+        got = [url for _, url in rep.upload(files, "0x0", 2)]
+        # one refused post retried and one post per content
+        assert len(server.posts) == 3
+        assert all(got)
+        assert got[0] == got[2] != got[1]
+        assert got[0].startswith(server.url)
+
+        assert [url for _, url in rep.upload(files, "0x0")] == got
+        assert len(server.posts) == 3
+
+        rep.upload(files[1:2], "0x0", again=True)
+        assert len(server.posts) == 4
+
+
+def test_upload_no_repost(tmp_path, server):
+    '''
+    A post failing with a server error is not made again
+    '''
+    server.fail = [503]
+    fname = tmp_path / "file.txt"
+    fname.write_text("a")
+    with rephile.upload.http(backoff=0) as ses:
+        assert rephile.ohecksoh.upload(str(fname), ses) is None
+    assert len(server.posts) == 1
+
+
+def test_upload_fail(tmp_path, monkeypatch):
+    '''
+    A file which can not be uploaded gives no URL
+    '''
+    monkeypatch.setattr(rephile.ohecksoh, "url", "http://127.0.0.1:1/")
+    fname = tmp_path / "file.txt"
+    fname.write_text("a")
+    with rephile.upload.http(retries=0) as ses:
+        assert rephile.ohecksoh.upload(str(fname), ses, timeout=1) is None
+
+
+def test_upload_raises(tmp_path, monkeypatch, capsys):
+    '''
+    An upload raising an error fails alone and the rest are recorded
+    '''
+    monkeypatch.setattr(rephile.attrs, "exif", lambda fs: [{} for f in fs])
+    files = list()
+    for text in "abc":
+        fname = tmp_path / f"{text}.txt"
+        fname.write_text(text)
+        files.append(str(fname))
+
+    def upload(fname, http):
+        if fname.endswith("b.txt"):
+            raise RuntimeError("rate limited")
+        return "http://example.com/" + os.path.basename(fname)
+
+    with Rephile("sqlite://") as rep:
+        paths = rep.paths(files)
+        got = rephile.upload.run(rep.session, paths, "test", upload)
+        assert got == ["http://example.com/a.txt", None,
+                       "http://example.com/c.txt"]
+        assert "rate limited" in capsys.readouterr().err
+        urls = rephile.upload.known(rep.session,
+                                    [p.digest_id for p in paths], "test")
+        assert sorted(urls.values()) == [got[0], got[2]]